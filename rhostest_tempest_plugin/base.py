@@ -13,18 +13,41 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import time
+
 from oslo_log import log as logging
 from tempest.api.compute import base
 from tempest.common.utils import data_utils
 from tempest.common import waiters
 from tempest import config
 
+from rhostest_tempest_plugin.lib import flavor_pool
+from rhostest_tempest_plugin.lib import hypervisors
+from rhostest_tempest_plugin.lib import log_harvester
+from rhostest_tempest_plugin.lib import profiling
+from rhostest_tempest_plugin.lib import server_pool
+from rhostest_tempest_plugin.lib import timing
+from rhostest_tempest_plugin.lib import waiters as rhos_waiters
+from rhostest_tempest_plugin.services import clients
+from rhostest_tempest_plugin.services import http_pool
+
 
 CONF = config.CONF
 LOG = logging.getLogger(__name__)
 
 
-class BaseRHOSTest(base.BaseV2ComputeAdminTest):
+class BaseRHOSTest(profiling.ProfilingMixin, log_harvester.LogHarvestMixin,
+                   timing.TimingMixin, base.BaseV2ComputeAdminTest):
+
+    # Resources the class sets up per worker, or must not use concurrently
+    # with other classes, see lib/scheduling.py.
+    shared_fixtures = ()
+
+    @classmethod
+    def resource_setup(cls):
+        # The clients set by setup_clients(), of tempest and the subclasses.
+        http_pool.share_clients(cls)
+        super(BaseRHOSTest, cls).resource_setup()
 
     def _create_nova_flavor(self, name, ram, vcpus, disk, fid):
         # This function creates a flavor with provided parameters
@@ -35,7 +58,18 @@ class BaseRHOSTest(base.BaseV2ComputeAdminTest):
                                               id=fid)['flavor']
         return flavor
 
-    def _create_nova_instance(self, flavor=None, image=None, cleanup=True):
+    def _get_pooled_flavor(self, ram, vcpus, disk, extra_specs=None):
+        """Return the id of a flavor of this shape shared by the run.
+
+        Unlike _create_nova_flavor(), the flavor is created once per run
+        and deleted at the end of it, not by the test.
+        """
+        return flavor_pool.get_flavor_pool().get_flavor(ram, vcpus, disk,
+                                                        extra_specs)
+
+    @timing.timed('server.boot')
+    def _create_nova_instance(self, flavor=None, image=None, cleanup=True,
+                              metadata=None):
         if flavor is None:
             flavor = CONF.compute.flavor_ref
         if image is None:
@@ -44,10 +78,14 @@ class BaseRHOSTest(base.BaseV2ComputeAdminTest):
         name = data_utils.rand_name("instance")
         net_id = CONF.network.public_network_id
         networks = [{'uuid': net_id}]
+        kwargs = {}
+        if metadata:
+            kwargs['metadata'] = metadata
         server = self.servers_client.create_server(name=name,
                                                    imageRef=image,
                                                    flavorRef=flavor,
-                                                   networks=networks)['server']
+                                                   networks=networks,
+                                                   **kwargs)['server']
         server_id = server['id']
 
         if cleanup:
@@ -55,4 +93,109 @@ class BaseRHOSTest(base.BaseV2ComputeAdminTest):
 
         waiters.wait_for_server_status(self.servers_client, server_id,
                                        'ACTIVE')
+        self._log_harvest_servers([server_id])
+        return server_id
+
+    @timing.timed('server.boot')
+    def _create_nova_instances(self, count, flavor=None, image=None,
+                               cleanup=True, metadata=None):
+        """Boot `count` servers at once and wait until they are all ACTIVE.
+
+        The servers are requested in a single call using min_count and
+        max_count, then waited for together, so the wall time is the one
+        of the slowest boot instead of the sum of all of them. Fails as
+        soon as one of the servers goes to ERROR.
+        """
+        if flavor is None:
+            flavor = CONF.compute.flavor_ref
+        if image is None:
+            image = CONF.compute.image_ref
+
+        name = data_utils.rand_name("instance")
+        net_id = CONF.network.public_network_id
+        networks = [{'uuid': net_id}]
+        kwargs = {}
+        if metadata:
+            kwargs['metadata'] = metadata
+        since = rhos_waiters.changes_since(time.time())
+        reservation_id = self.servers_client.create_server(
+            name=name,
+            imageRef=image,
+            flavorRef=flavor,
+            networks=networks,
+            min_count=count,
+            max_count=count,
+            return_reservation_id=True,
+            **kwargs)['reservation_id']
+        servers = self.servers_client.list_servers(
+            reservation_id=reservation_id)['servers']
+        server_ids = [server['id'] for server in servers]
+
+        if cleanup:
+            for server_id in server_ids:
+                self.addCleanup(self.servers_client.delete_server, server_id)
+
+        self.assertEqual(count, len(server_ids))
+        self._wait_for_servers_status(server_ids, 'ACTIVE', since=since)
+        self._log_harvest_servers(server_ids)
+        return server_ids
+
+    def _wait_for_servers_status(self, server_ids, status, since=None):
+        """Wait for all of `server_ids` to reach `status`.
+
+        See lib.waiters.wait_for_servers_status.
+        """
+        return rhos_waiters.wait_for_servers_status(
+            self.servers_client, server_ids, status, since=since)
+
+    def _get_server_host_ip(self, server_id):
+        """Return the IP of the compute node hosting `server_id`."""
+        server = self.os_adm.servers_client.show_server(server_id)['server']
+        hostname = server['OS-EXT-SRV-ATTR:host']
+        return hypervisors.get_hypervisor_index().get_host_ip(
+            self.os_adm.hypervisor_client, hostname)
+
+    def _log_harvest_servers(self, server_ids):
+        """Harvest the logs of the computes hosting `server_ids` as well.
+
+        Only the lines written once the servers are ACTIVE are collected
+        from those computes, their hosts are not known before.
+        """
+        if self._log_harvester is None:
+            return
+        try:
+            self._log_harvest_add_hosts(set(
+                self._get_server_host_ip(server_id)
+                for server_id in server_ids))
+        except Exception:
+            LOG.exception('Unable to harvest the logs of the computes '
+                          'hosting %s', ', '.join(server_ids))
+
+    def _execute_on_computes(self, cmd, timeout=None):
+        """Run `cmd` on all the compute nodes concurrently.
+
+        :returns: {compute service host: concurrency.Outcome}, see
+            SSHClient.execute_on_hosts.
+        """
+        host_ips = hypervisors.get_hypervisor_index().get_host_ips(
+            self.os_adm.hypervisor_client)
+        outcomes = clients.SSHClient().execute_on_hosts(
+            host_ips.values(), cmd, timeout)
+        return dict((host, outcomes[ip]) for host, ip in host_ips.items())
+
+    def _lease_server(self, flavor=None, image=None, metadata=None):
+        """Lease an ACTIVE server from the run's server pool.
+
+        Meant for tests which only inspect the server. The server belongs
+        to the project of the configured admin, not to the one of the test
+        class. It goes back to the pool when the test ends, unless it was
+        passed to _mark_server_dirty(), in which case it is deleted.
+        """
+        pool = server_pool.get_server_pool()
+        server_id = pool.lease(flavor, image, metadata)
+        self.addCleanup(pool.release, server_id)
+        self._log_harvest_servers([server_id])
         return server_id
+
+    def _mark_server_dirty(self, server_id):
+        server_pool.get_server_pool().mark_dirty(server_id)
@@ -0,0 +1,43 @@
+# Copyright 2016 Red Hat
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+import os
+
+TEMPEST_CONF = """[DEFAULT]
+log_file = {log_file}
+
+[compute]
+image_ref = bench-image
+flavor_ref = bench-flavor
+
+[network]
+public_network_id = bench-network
+
+[compute_private_config]
+target_controller = controller
+target_ssh_user = heat-admin
+target_private_key_path = /dev/null
+"""
+
+
+def write_tempest_conf(conf_dir):
+    """Write a tempest config for the stand-ins to `conf_dir`.
+
+    Returns the environment variables pointing tempest to it.
+    """
+    with open(os.path.join(conf_dir, 'tempest.conf'), 'w') as conf_file:
+        conf_file.write(TEMPEST_CONF.format(
+            log_file=os.path.join(conf_dir, 'tempest.log')))
+    return {'TEMPEST_CONFIG_DIR': conf_dir,
+            'TEMPEST_CONFIG': 'tempest.conf'}
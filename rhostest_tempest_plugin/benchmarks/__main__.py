@@ -0,0 +1,75 @@
+# Copyright 2016 Red Hat
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""Run the offline benchmarks of the plugin.
+
+No cloud is needed: the compute API, the SSH nodes and the nova db are
+replaced by the stand-ins of rhostest_tempest_plugin.benchmarks.fakes.
+
+    python -m rhostest_tempest_plugin.benchmarks [-k NAME] [--scale 0.5]
+        [--json results.json]
+"""
+import argparse
+import json
+import os
+import shutil
+import tempfile
+
+from rhostest_tempest_plugin import benchmarks
+
+
+def _configure_tempest(conf_dir):
+    """Point tempest to a config for the stand-ins, before importing it."""
+    os.environ.update(benchmarks.write_tempest_conf(conf_dir))
+
+    from oslo_config import cfg
+    from tempest import config
+
+    from rhostest_tempest_plugin import config as project_config
+
+    # Only registered by tempest when the plugin is installed.
+    config.register_opt_group(cfg.CONF,
+                              project_config.compute_private_group,
+                              project_config.ComputePrivateGroup)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-k', dest='selected', action='append',
+                        help='Only run the benchmarks whose name contains '
+                             'this string. Can be repeated.')
+    parser.add_argument('--scale', type=float, default=1.0,
+                        help='Multiplier of the iterations of each '
+                             'benchmark.')
+    parser.add_argument('--json', dest='json_path',
+                        help='Also write the results to this file.')
+    args = parser.parse_args()
+
+    conf_dir = tempfile.mkdtemp(prefix='rhos-bench-')
+    try:
+        _configure_tempest(conf_dir)
+        from rhostest_tempest_plugin.benchmarks import suite
+
+        results = suite.run(args.selected, args.scale)
+    finally:
+        shutil.rmtree(conf_dir)
+    print(suite.report(results))
+    if args.json_path:
+        with open(args.json_path, 'w') as json_file:
+            json.dump(suite.as_dict(results), json_file, indent=2,
+                      sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
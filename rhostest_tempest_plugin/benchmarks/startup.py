@@ -0,0 +1,121 @@
+# Copyright 2016 Red Hat
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""Measure the startup cost of the plugin.
+
+Each run is a fresh interpreter which loads the plugin the way tempest
+does, then discovers its tests the way `tempest run --list-tests` does.
+Run it on two revisions to compare them:
+
+    python -m rhostest_tempest_plugin.benchmarks.startup [--runs 10]
+        [--json startup.json]
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from rhostest_tempest_plugin import benchmarks
+
+MODULE = 'rhostest_tempest_plugin.benchmarks.startup'
+
+# Modules the plugin should only load once tests actually run.
+HEAVY_MODULES = ['lxml.etree', 'paramiko', 'pymysql',
+                 'tempest.common.compute', 'tempest.lib.common.ssh']
+
+
+def _child():
+    """Load and discover the plugin tests, print the timings as JSON."""
+    import unittest
+
+    start = time.time()
+    from oslo_config import cfg
+
+    from rhostest_tempest_plugin import plugin
+
+    rhos_plugin = plugin.RHOSTempestPlugin()
+    rhos_plugin.register_opts(cfg.CONF)
+    test_dir, top_dir = rhos_plugin.load_tests()
+    loaded = time.time()
+    tests = unittest.TestLoader().discover(test_dir, top_level_dir=top_dir)
+    discovered = time.time()
+    json.dump({'plugin_load': loaded - start,
+               'discovery': discovered - loaded,
+               'tests': tests.countTestCases(),
+               'heavy_modules': [name for name in HEAVY_MODULES
+                                 if name in sys.modules]},
+              sys.stdout)
+
+
+def _median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2.0
+
+
+def run(runs):
+    conf_dir = tempfile.mkdtemp(prefix='rhos-bench-')
+    env = dict(os.environ)
+    env.update(benchmarks.write_tempest_conf(conf_dir))
+    samples = []
+    try:
+        for _ in range(runs):
+            start = time.time()
+            output = subprocess.check_output(
+                [sys.executable, '-m', MODULE, '--child'], env=env)
+            sample = json.loads(output.decode('utf-8'))
+            sample['total'] = time.time() - start
+            samples.append(sample)
+    finally:
+        shutil.rmtree(conf_dir)
+    return {'runs': runs,
+            'tests': samples[-1]['tests'],
+            'heavy_modules': samples[-1]['heavy_modules'],
+            'plugin_load': _median(s['plugin_load'] for s in samples),
+            'discovery': _median(s['discovery'] for s in samples),
+            'total': _median(s['total'] for s in samples)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=10,
+                        help='Number of interpreters to start.')
+    parser.add_argument('--json', dest='json_path',
+                        help='Also write the results to this file.')
+    parser.add_argument('--child', action='store_true',
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        _child()
+        return
+
+    result = run(args.runs)
+    print('median of {runs} runs, {tests} tests discovered'.format(**result))
+    for phase in ('plugin_load', 'discovery', 'total'):
+        print('{:<12} {:>8.3f} s'.format(phase, result[phase]))
+    print('heavy modules loaded: {}'.format(
+        ', '.join(result['heavy_modules']) or 'none'))
+    if args.json_path:
+        with open(args.json_path, 'w') as json_file:
+            json.dump(result, json_file, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
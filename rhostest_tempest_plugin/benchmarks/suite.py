@@ -0,0 +1,349 @@
+# Copyright 2016 Red Hat
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""Benchmarks of the plugin's own code paths against local stand-ins.
+
+Each benchmark is a setup function registered with @benchmark. It
+returns the operation to measure and a function returning counters to
+report along with the latencies (API calls, SSH connections, ...).
+"""
+import collections
+import itertools
+import timeit
+
+import six
+
+from rhostest_tempest_plugin import base
+from rhostest_tempest_plugin.benchmarks import fakes
+from rhostest_tempest_plugin.lib import domain_xml
+from rhostest_tempest_plugin.lib import hypervisors
+from rhostest_tempest_plugin.lib import quota_scale
+from rhostest_tempest_plugin.lib import timing
+from rhostest_tempest_plugin.lib import waiters
+from rhostest_tempest_plugin.services import clients
+from rhostest_tempest_plugin.services import ssh_pool
+from rhostest_tempest_plugin.tests.api import base as api_base
+
+# Latencies of the stand-in SSH nodes, roughly those of a loaded
+# controller over a LAN.
+CONNECT_LATENCY = 0.005
+COMMAND_LATENCY = 0.0005
+
+Benchmark = collections.namedtuple('Benchmark', ['name', 'setup',
+                                                 'iterations'])
+Result = collections.namedtuple('Result', ['name', 'iterations', 'total',
+                                           'latencies', 'counters'])
+
+BENCHMARKS = []
+
+
+def benchmark(name, iterations=100):
+    def decorator(setup):
+        BENCHMARKS.append(Benchmark(name, setup, iterations))
+        return setup
+    return decorator
+
+
+def _install_remote(pool_size=4):
+    """Route the SSH clients to a new FakeRemote and reset the caches."""
+    remote = fakes.FakeRemote(CONNECT_LATENCY, COMMAND_LATENCY)
+    ssh_pool._POOL = ssh_pool.SSHConnectionPool(max_size=pool_size,
+                                                connect=remote.connect)
+    clients._DB_CONNECTIONS.clear()
+    clients._DOMAINS.clear()
+    return remote
+
+
+def _remote_counters(remote):
+    counters = dict(remote.stats)
+    counters.update(('pool_' + key, value)
+                    for key, value in ssh_pool._POOL.stats.items())
+    return counters
+
+
+class _TestStub(object):
+    """The parts of a test case the base class helpers rely on."""
+
+    def __init__(self, servers_client):
+        self.servers_client = servers_client
+        self.cleanups = []
+
+    def addCleanup(self, func, *args, **kwargs):
+        self.cleanups.append((func, args, kwargs))
+
+    def assertEqual(self, expected, observed):
+        assert expected == observed, (expected, observed)
+
+    def _log_harvest_servers(self, server_ids):
+        pass
+
+    _wait_for_servers_status = six.get_unbound_function(
+        base.BaseRHOSTest._wait_for_servers_status)
+
+
+class _NoopClient(object):
+    """A service client whose every call succeeds and returns None."""
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: None
+
+
+@benchmark('ssh.execute.pooled', iterations=200)
+def bench_ssh_pooled():
+    remote = _install_remote()
+    client = clients.SSHClient()
+    return (lambda: client.execute('controller', 'uname -a'),
+            lambda: _remote_counters(remote))
+
+
+@benchmark('ssh.execute.unpooled', iterations=200)
+def bench_ssh_unpooled():
+    remote = _install_remote(pool_size=0)
+    client = clients.SSHClient()
+    return (lambda: client.execute('controller', 'uname -a'),
+            lambda: _remote_counters(remote))
+
+
+@benchmark('ssh.execute_on_hosts', iterations=20)
+def bench_ssh_fanout():
+    remote = _install_remote()
+    client = clients.SSHClient()
+    hosts = ['compute-{}'.format(index) for index in range(50)]
+    return (lambda: client.execute_on_hosts(hosts, 'sudo virsh list'),
+            lambda: _remote_counters(remote))
+
+
+@benchmark('mysql.client_setup', iterations=200)
+def bench_mysql_setup():
+    remote = _install_remote()
+    return clients.MySQLClient, lambda: _remote_counters(remote)
+
+
+@benchmark('mysql.execute_queries', iterations=100)
+def bench_mysql_queries():
+    remote = _install_remote()
+    remote.db.execute('CREATE TABLE quota_usages '
+                      '(project_id TEXT, resource TEXT, in_use INTEGER)')
+    remote.db.executemany(
+        'INSERT INTO quota_usages VALUES (?, ?, ?)',
+        [('p{}'.format(index % 10), 'r{}'.format(index), index)
+         for index in range(1000)])
+    client = clients.MySQLClient()
+    select = ('SELECT resource,in_use FROM quota_usages '
+              'WHERE project_id = %s', ('p1',))
+    update = ('UPDATE quota_usages SET in_use=in_use WHERE project_id = %s',
+              ('p1',))
+    return (lambda: client.execute_queries([select, select, update, select]),
+            lambda: _remote_counters(remote))
+
+
+@benchmark('mysql.iter_query', iterations=100)
+def bench_mysql_iter_query():
+    remote = _install_remote()
+    remote.db.execute('CREATE TABLE quota_usages '
+                      '(project_id TEXT, resource TEXT, in_use INTEGER)')
+    remote.db.executemany(
+        'INSERT INTO quota_usages VALUES (?, ?, ?)',
+        [('p{}'.format(index % 10), 'r{}'.format(index), index)
+         for index in range(1000)])
+    client = clients.MySQLClient()
+
+    def op():
+        # Stops reading once the row is found.
+        for row in client.iter_query('SELECT resource,in_use '
+                                     'FROM quota_usages'):
+            if row['resource'] == 'r10':
+                break
+    return op, lambda: _remote_counters(remote)
+
+
+@benchmark('mysql.parse_batch_output', iterations=50)
+def bench_parse_batch():
+    markers = ['rhos_bench_0']
+    rows = ''.join('server-{0}\tproject-{1}\t{1}\n'.format(index, index % 7)
+                   for index in range(10000))
+    output = 'rhos_bench_0\nrhos_bench_0\nuuid\tproject_id\tvcpus\n' + rows
+    return (lambda: clients.parse_batch_output(output, markers),
+            lambda: {'rows': 10000})
+
+
+@benchmark('virsh.get_domain', iterations=200)
+def bench_get_domain():
+    remote = _install_remote()
+    client = clients.VirshXMLClient('compute-0')
+    generations = itertools.count()
+
+    def op():
+        # A new generation each time, so the XML is fetched and parsed.
+        domain = client.get_domain('instance-0001', next(generations))
+        domain.input_devices()
+        domain.cpu_pinning()
+        domain.numa_cells()
+        domain.disks()
+    return op, lambda: _remote_counters(remote)
+
+
+@benchmark('virsh.get_domains.fanout', iterations=10)
+def bench_get_domains():
+    remote = _install_remote()
+    domains_by_host = dict(
+        ('compute-{}'.format(host),
+         ['instance-{:04d}'.format(index) for index in range(10)])
+        for host in range(8))
+    generations = itertools.count()
+
+    def op():
+        clients.VirshXMLClient.get_domains(domains_by_host,
+                                           next(generations))
+    return op, lambda: _remote_counters(remote)
+
+
+@benchmark('domain_xml.parse', iterations=1000)
+def bench_domain_xml():
+    xml = fakes.DOMAIN_XML.format(name='instance-0001', uuid='uuid')
+    return (lambda: domain_xml.DomainXML(xml).input_devices(),
+            lambda: {'parser': domain_xml._import_etree().__name__})
+
+
+@benchmark('hypervisors.get_host_ip', iterations=1000)
+def bench_hypervisor_index():
+    client = fakes.FakeHypervisorClient(count=500)
+    index = hypervisors.HypervisorIndex(ttl=600)
+    hosts = itertools.cycle('compute-{}'.format(i) for i in range(500))
+    return (lambda: index.get_host_ip(client, next(hosts)),
+            lambda: dict(client.calls))
+
+
+@benchmark('waiters.wait_for_servers_status', iterations=5)
+def bench_wait_for_servers():
+    client = fakes.FakeServersClient(boot_time=0.2)
+
+    def op():
+        reservation_id = client.create_server(
+            'bench', 'image', 'flavor', [], min_count=50, max_count=50,
+            return_reservation_id=True)['reservation_id']
+        servers = client.list_servers(
+            reservation_id=reservation_id)['servers']
+        waiters.wait_for_servers_status(
+            client, [server['id'] for server in servers], 'ACTIVE')
+    return op, lambda: dict(client.calls)
+
+
+@benchmark('base.create_nova_instances', iterations=5)
+def bench_create_nova_instances():
+    client = fakes.FakeServersClient(boot_time=0.2)
+    test = _TestStub(client)
+    create = six.get_unbound_function(
+        base.BaseRHOSTest._create_nova_instances)
+    return lambda: create(test, 10), lambda: dict(client.calls)
+
+
+@benchmark('api_base.resource_cleanup', iterations=5)
+def bench_resource_cleanup():
+    client = fakes.FakeServersClient(boot_time=0, delete_time=0.1)
+    test_class = type('BenchCleanup', (api_base.BaseRHOSTest,), {})
+    test_class.servers_client = client
+    test_class.compute_images_client = _NoopClient()
+    test_class.security_groups_client = _NoopClient()
+    test_class.server_groups_client = _NoopClient()
+    test_class.images = []
+    test_class.security_groups = []
+    test_class.server_groups = []
+
+    def op():
+        reservation_id = client.create_server(
+            'bench', 'image', 'flavor', [], min_count=20, max_count=20,
+            return_reservation_id=True)['reservation_id']
+        test_class.servers = client.list_servers(
+            reservation_id=reservation_id)['servers']
+        test_class._run_cleanup_phase(test_class.clear_images,
+                                      test_class.clear_servers)
+        test_class._run_cleanup_phase(test_class.clear_security_groups,
+                                      test_class.clear_server_groups)
+    return op, lambda: dict(client.calls)
+
+
+@benchmark('quota_scale.refresh', iterations=3)
+def bench_quota_scale():
+    remote = _install_remote(pool_size=8)
+    db_client = clients.MySQLClient()
+    quota_scale.create_schema(db_client)
+
+    def nova_manage_refresh(args):
+        # --project <project> --user <user>
+        remote.db.execute_script(clients._format_query(
+            quota_scale.REFRESH_SQL, (args[1], args[3])))
+        return ''
+    remote.nova_manage_handlers[('project', 'quota_usage_refresh')] = (
+        nova_manage_refresh)
+    refresh = quota_scale.nova_manage_refresh(clients.NovaManageClient())
+    reports = []
+
+    def op():
+        reports.append(quota_scale.measure(db_client, refresh, 200, 5))
+
+    def counters():
+        counters = _remote_counters(remote)
+        counters['db_statements'] = remote.db.statements
+        counters['refresh_p95_ms'] = int(reports[-1]['refresh_p95'] * 1000)
+        counters['stale_usages'] = reports[-1]['stale_usages']
+        return counters
+    return op, counters
+
+
+def run(selected=None, scale=1.0):
+    """Run the benchmarks whose name contains one of `selected`."""
+    results = []
+    for bench in BENCHMARKS:
+        if selected and not any(name in bench.name for name in selected):
+            continue
+        op, counters = bench.setup()
+        iterations = max(int(bench.iterations * scale), 1)
+        latencies = []
+        start = timeit.default_timer()
+        for _ in range(iterations):
+            op_start = timeit.default_timer()
+            op()
+            latencies.append(timeit.default_timer() - op_start)
+        total = timeit.default_timer() - start
+        results.append(Result(bench.name, iterations, total,
+                              sorted(latencies), counters()))
+    return results
+
+
+def report(results):
+    lines = ['{:<34} {:>6} {:>10} {:>9} {:>9} {:>9}  {}'.format(
+        'benchmark', 'n', 'ops/s', 'p50 ms', 'p95 ms', 'p99 ms', 'counters')]
+    for result in results:
+        lines.append(
+            '{:<34} {:>6} {:>10.1f} {:>9.3f} {:>9.3f} {:>9.3f}  {}'.format(
+                result.name, result.iterations,
+                result.iterations / result.total,
+                timing.percentile(result.latencies, 50) * 1000,
+                timing.percentile(result.latencies, 95) * 1000,
+                timing.percentile(result.latencies, 99) * 1000,
+                ' '.join('{}={}'.format(key, value) for key, value in
+                         sorted(result.counters.items()))))
+    return '\n'.join(lines)
+
+
+def as_dict(results):
+    return [{'name': result.name,
+             'iterations': result.iterations,
+             'ops_per_second': result.iterations / result.total,
+             'p50': timing.percentile(result.latencies, 50),
+             'p95': timing.percentile(result.latencies, 95),
+             'p99': timing.percentile(result.latencies, 99),
+             'counters': result.counters}
+            for result in results]
@@ -0,0 +1,61 @@
+# Copyright 2016 Red Hat
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+import collections
+import sys
+import threading
+
+from six.moves import queue
+
+
+DEFAULT_WORKERS = 8
+
+Outcome = collections.namedtuple('Outcome', ['item', 'result', 'error',
+                                             'exc_info'])
+
+
+def run_concurrently(func, items, max_workers=DEFAULT_WORKERS):
+    """Call `func` on each of `items` from a bounded pool of threads.
+
+    Failures are isolated: an exception raised for one item is recorded in
+    its outcome and does not stop the others.
+
+    :returns: an Outcome per item, in the order of `items`. `error` and
+        `exc_info` are None unless the call raised.
+    """
+    items = list(items)
+    outcomes = [None] * len(items)
+    work = queue.Queue()
+    for index, item in enumerate(items):
+        work.put((index, item))
+
+    def worker():
+        while True:
+            try:
+                index, item = work.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                outcomes[index] = Outcome(item, func(item), None, None)
+            except Exception as exc:
+                outcomes[index] = Outcome(item, None, exc, sys.exc_info())
+
+    threads = [threading.Thread(target=worker)
+               for _ in range(min(max(max_workers, 1), len(items)))]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return outcomes
@@ -0,0 +1,115 @@
+# Copyright 2016 Red Hat
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+import importlib
+
+import six
+
+# The XML parser is picked on first use: lxml if installed, else the
+# standard library one.
+etree = None
+
+
+def _import_etree():
+    global etree
+    if etree is None:
+        for name in ('lxml.etree', 'xml.etree.cElementTree'):
+            try:
+                etree = importlib.import_module(name)
+                break
+            except ImportError:
+                pass
+        else:
+            etree = importlib.import_module('xml.etree.ElementTree')
+    return etree
+
+
+class DomainXML(object):
+    """Parsed libvirt domain XML, as returned by `virsh dumpxml`."""
+
+    def __init__(self, xml):
+        if isinstance(xml, six.text_type):
+            xml = xml.encode('utf-8')
+        self.root = _import_etree().fromstring(xml)
+
+    @property
+    def name(self):
+        return self.root.findtext('name')
+
+    @property
+    def uuid(self):
+        return self.root.findtext('uuid')
+
+    def find(self, path):
+        """Return the first element matching `path`.
+
+        Paths use the XPath subset of ElementTree, with either parser.
+        """
+        return self.root.find(path)
+
+    def findall(self, path):
+        return self.root.findall(path)
+
+    def devices(self, tag=None):
+        """Return the elements under <devices>, optionally of one tag."""
+        return self.root.findall('devices/{}'.format(tag or '*'))
+
+    def input_devices(self):
+        """Return the (type, bus) of each input device."""
+        return [(dev.get('type'), dev.get('bus'))
+                for dev in self.devices('input')]
+
+    def disks(self):
+        """Return a dict describing each disk device."""
+        disks = []
+        for disk in self.devices('disk'):
+            source = disk.find('source')
+            target = disk.find('target')
+            driver = disk.find('driver')
+            source_path = None
+            if source is not None:
+                source_path = (source.get('file') or source.get('dev') or
+                               source.get('name'))
+            disks.append({
+                'type': disk.get('type'),
+                'device': disk.get('device'),
+                'source': source_path,
+                'target': None if target is None else target.get('dev'),
+                'bus': None if target is None else target.get('bus'),
+                'driver': None if driver is None else driver.get('type'),
+            })
+        return disks
+
+    def cpu_pinning(self):
+        """Return the {vcpu: cpuset} pinning from <cputune>."""
+        return dict((int(pin.get('vcpu')), pin.get('cpuset'))
+                    for pin in self.root.findall('cputune/vcpupin'))
+
+    def emulator_pinning(self):
+        pin = self.root.find('cputune/emulatorpin')
+        return None if pin is None else pin.get('cpuset')
+
+    def numa_cells(self):
+        """Return a dict describing each guest NUMA cell."""
+        return [{'id': int(cell.get('id', index)),
+                 'cpus': cell.get('cpus'),
+                 'memory': int(cell.get('memory')),
+                 'unit': cell.get('unit', 'KiB')}
+                for index, cell in enumerate(
+                    self.root.findall('cpu/numa/cell'))]
+
+    def numa_memory_nodes(self):
+        """Return the {guest cell: host nodeset} mapping of <numatune>."""
+        return dict((int(node.get('cellid')), node.get('nodeset'))
+                    for node in self.root.findall('numatune/memnode'))
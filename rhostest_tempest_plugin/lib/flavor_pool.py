@@ -0,0 +1,156 @@
+# Copyright 2016 Red Hat
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+import atexit
+import errno
+import hashlib
+import json
+import os
+import tempfile
+import threading
+
+from oslo_concurrency import lockutils
+from oslo_log import log as logging
+from tempest import config
+from tempest.lib.common.utils import test_utils
+from tempest.lib import exceptions
+
+from rhostest_tempest_plugin.services import admin
+
+CONF = config.CONF
+LOG = logging.getLogger(__name__)
+
+FLAVOR_PREFIX = 'rhos-pool-'
+
+
+def flavor_id_for(ram, vcpus, disk, extra_specs=None):
+    """Return the id, also used as name, of the pooled flavor of a shape."""
+    specs = json.dumps(extra_specs or {}, sort_keys=True)
+    digest = hashlib.sha1(specs.encode('utf-8')).hexdigest()[:8]
+    return '{}{}-{}-{}-{}'.format(FLAVOR_PREFIX, ram, vcpus, disk, digest)
+
+
+def _is_running(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as exc:
+        return exc.errno == errno.EPERM
+    return True
+
+
+class FlavorPool(object):
+    """Shares one flavor per (ram, vcpus, disk, extra_specs) shape.
+
+    Pooled flavors have an id derived from their shape, so every test
+    class and every worker of a run asking for the same shape gets the
+    same flavor. The workers using each flavor are tracked in a state file
+    under `state_dir`, guarded by an external lock, and the last worker
+    using a flavor deletes it when it exits.
+
+    Flavors are created and deleted with `client`, by default the flavors
+    client of the run's admin manager: the clients of the test classes
+    are no longer valid once their class was torn down.
+    """
+
+    def __init__(self, state_dir, client=None):
+        self.state_dir = state_dir
+        self.state_file = os.path.join(state_dir, 'rhostest-flavor-pool.json')
+        self._client = client
+        self._flavors = set()
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = admin.get_admin_manager().flavors_client
+        return self._client
+
+    def _external_lock(self):
+        return lockutils.lock('rhostest-flavor-pool', external=True,
+                              lock_path=self.state_dir)
+
+    def _update_users(self, flavor_id, register):
+        """(Un)register this process as user of `flavor_id`.
+
+        Must be called with the external lock held. Returns the other live
+        processes using the flavor.
+        """
+        try:
+            with open(self.state_file) as state_file:
+                state = json.load(state_file)
+        except (IOError, ValueError):
+            state = {}
+        others = [pid for pid in state.get(flavor_id, [])
+                  if pid != os.getpid() and _is_running(pid)]
+        users = others + [os.getpid()] if register else others
+        if users:
+            state[flavor_id] = users
+        else:
+            state.pop(flavor_id, None)
+        with open(self.state_file, 'w') as state_file:
+            json.dump(state, state_file)
+        return others
+
+    def get_flavor(self, ram, vcpus, disk, extra_specs=None):
+        """Return the id of the pooled flavor, creating it if needed."""
+        flavor_id = flavor_id_for(ram, vcpus, disk, extra_specs)
+        with self._lock:
+            if flavor_id in self._flavors:
+                return flavor_id
+            client = self.client
+            with self._external_lock():
+                self._update_users(flavor_id, register=True)
+                try:
+                    client.show_flavor(flavor_id)
+                except exceptions.NotFound:
+                    LOG.info('Creating pooled flavor %s', flavor_id)
+                    client.create_flavor(name=flavor_id, ram=ram,
+                                         vcpus=vcpus, disk=disk,
+                                         id=flavor_id)
+                    if extra_specs:
+                        client.set_flavor_extra_spec(flavor_id,
+                                                     **extra_specs)
+            self._flavors.add(flavor_id)
+        return flavor_id
+
+    def release_all(self):
+        """Delete the pooled flavors no other live worker is using."""
+        with self._lock:
+            flavors, self._flavors = self._flavors, set()
+        for flavor_id in sorted(flavors):
+            with self._external_lock():
+                if self._update_users(flavor_id, register=False):
+                    continue
+                try:
+                    test_utils.call_and_ignore_notfound_exc(
+                        self.client.delete_flavor, flavor_id)
+                except Exception:
+                    LOG.exception('Unable to delete pooled flavor %s',
+                                  flavor_id)
+
+
+_POOL = None
+_POOL_LOCK = threading.Lock()
+
+
+def get_flavor_pool():
+    """Return the process wide flavor pool."""
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL is None:
+            state_dir = (CONF.compute_private_config.run_state_dir or
+                         tempfile.gettempdir())
+            _POOL = FlavorPool(state_dir)
+            atexit.register(_POOL.release_all)
+        return _POOL
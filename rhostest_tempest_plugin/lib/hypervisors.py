@@ -0,0 +1,86 @@
+# Copyright 2016 Red Hat
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+import threading
+import time
+
+from oslo_log import log as logging
+from tempest import config
+
+
+CONF = config.CONF
+LOG = logging.getLogger(__name__)
+
+
+class HypervisorIndex(object):
+    """Maps the compute service host of the hypervisors to their IP.
+
+    The hypervisor list is fetched once and kept for `ttl` seconds. A
+    lookup of an unknown host refreshes it right away, since the host may
+    be a newly added compute node.
+    """
+
+    def __init__(self, ttl=600):
+        self.ttl = ttl
+        self._host_ips = {}
+        self._loaded_at = None
+        self._lock = threading.Lock()
+
+    def _expired(self):
+        return (self._loaded_at is None or
+                time.time() - self._loaded_at > self.ttl)
+
+    def refresh(self, hypervisor_client):
+        hypervisors = hypervisor_client.list_hypervisors(
+            detail=True)['hypervisors']
+        host_ips = dict((hypervisor['service']['host'],
+                         hypervisor['host_ip'])
+                        for hypervisor in hypervisors)
+        with self._lock:
+            self._host_ips = host_ips
+            self._loaded_at = time.time()
+        LOG.debug('Indexed %d hypervisors', len(host_ips))
+
+    def invalidate(self):
+        with self._lock:
+            self._loaded_at = None
+
+    def get_host_ip(self, hypervisor_client, host):
+        """Return the IP of compute service `host`, None if unknown."""
+        if self._expired():
+            self.refresh(hypervisor_client)
+        elif host not in self._host_ips:
+            LOG.debug('Host %s not indexed, refreshing hypervisors', host)
+            self.refresh(hypervisor_client)
+        return self._host_ips.get(host)
+
+    def get_host_ips(self, hypervisor_client):
+        """Return the {host: IP} mapping of all the hypervisors."""
+        if self._expired():
+            self.refresh(hypervisor_client)
+        return dict(self._host_ips)
+
+
+_INDEX = None
+_INDEX_LOCK = threading.Lock()
+
+
+def get_hypervisor_index():
+    """Return the process wide hypervisor index."""
+    global _INDEX
+    with _INDEX_LOCK:
+        if _INDEX is None:
+            _INDEX = HypervisorIndex(
+                ttl=CONF.compute_private_config.hypervisor_cache_ttl)
+        return _INDEX
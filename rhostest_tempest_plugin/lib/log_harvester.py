@@ -0,0 +1,208 @@
+# Copyright 2016 Red Hat
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""Collect the log lines written on the nodes while a test runs."""
+import base64
+import uuid
+import zlib
+
+from oslo_log import log as logging
+from six.moves import shlex_quote
+from tempest import config
+from testtools import content
+
+from rhostest_tempest_plugin.lib import concurrency
+from rhostest_tempest_plugin.lib import timing
+from rhostest_tempest_plugin.services import clients
+from rhostest_tempest_plugin.services import routing
+
+CONF = config.CONF
+LOG = logging.getLogger(__name__)
+
+# Inode recorded for the files missing when the harvest starts.
+NO_INODE = 0
+
+_FETCH = ('tail -c +$(($2 + 1)) "$1" | head -c {max_bytes} | gzip -c | '
+          'base64 -w0; echo')
+
+
+class LogHarvester(object):
+    """Fetches what was appended to log files on several hosts.
+
+    start() records the inode and size of each file, finish() then
+    fetches the bytes written since, gzipped over SSH. A file rotated in
+    between is read from its previous offset in `<file>.1`, then from the
+    start of the new file. At most `max_bytes` bytes are fetched per file
+    and per part. Hosts are reached concurrently, a failing host is logged
+    and skipped.
+    """
+
+    def __init__(self, files, max_bytes, ssh_client=None):
+        self.files = list(files)
+        self.max_bytes = max_bytes
+        self.ssh_client = ssh_client or clients.SSHClient()
+        # host -> [(inode, size)] per file
+        self.offsets = {}
+
+    def _run(self, func, hosts):
+        results = {}
+        for outcome in concurrency.run_concurrently(
+                func, set(hosts),
+                CONF.compute_private_config.ssh_fanout_workers):
+            if outcome.error is not None:
+                LOG.warning('Harvesting logs of %s failed: %s',
+                            outcome.item, outcome.error)
+                continue
+            results[outcome.item] = outcome.result
+        return results
+
+    def _stat_script(self, token):
+        # Missing files are skipped.
+        return ''.join(
+            's=$(stat -c "%i %s" {path} 2>/dev/null) && '
+            'echo "{token} {index} $s"\n'.format(
+                path=shlex_quote(path), token=token, index=index)
+            for index, path in enumerate(self.files)) + 'true\n'
+
+    def _stat(self, host):
+        token = 'rhos_log_{}'.format(uuid.uuid4().hex[:8])
+        output = self.ssh_client.execute(
+            host, 'sudo bash -c {}'.format(
+                shlex_quote(self._stat_script(token))))
+        offsets = [(NO_INODE, 0)] * len(self.files)
+        for line in output.split('\n'):
+            fields = line.split()
+            if len(fields) == 4 and fields[0] == token:
+                offsets[int(fields[1])] = (int(fields[2]), int(fields[3]))
+        return offsets
+
+    @timing.timed('logs.start')
+    def start(self, hosts):
+        """Record the current end of the log files on `hosts`."""
+        self.offsets.update(self._run(self._stat, hosts))
+
+    def _fetch_script(self, token, offsets):
+        lines = ['fetch() {{ {}; }}'.format(
+            _FETCH.format(max_bytes=self.max_bytes))]
+        for index, (path, (inode, offset)) in enumerate(zip(self.files,
+                                                            offsets)):
+            lines.append("""f={path}; i={inode}; o={offset}
+s=$(stat -c "%i %s" "$f" 2>/dev/null)
+if [ -n "$s" ]; then
+  set -- $s
+  if [ "$1" != "$i" ] || [ "$2" -lt "$o" ]; then
+    r=$(stat -c "%i %s" "$f.1" 2>/dev/null)
+    if [ "${{r%% *}}" = "$i" ]; then
+      echo "{token} {index} rotated $o ${{r#* }}"; fetch "$f.1" "$o"
+    fi
+    o=0
+  fi
+  echo "{token} {index} current $o $2"; fetch "$f" "$o"
+fi""".format(path=shlex_quote(path), inode=inode, offset=offset,
+             token=token, index=index))
+        return '\n'.join(lines) + '\n'
+
+    def _fetch(self, host):
+        token = 'rhos_log_{}'.format(uuid.uuid4().hex[:8])
+        offsets = self.offsets.get(host,
+                                   [(NO_INODE, 0)] * len(self.files))
+        output = self.ssh_client.execute(
+            host, 'sudo bash -c {}'.format(
+                shlex_quote(self._fetch_script(token, offsets))))
+        logs = {}
+        lines = iter(output.split('\n'))
+        for line in lines:
+            fields = line.split()
+            if len(fields) != 5 or fields[0] != token:
+                continue
+            path = self.files[int(fields[1])]
+            data = zlib.decompress(base64.b64decode(next(lines)),
+                                   16 + zlib.MAX_WBITS)
+            if int(fields[4]) - int(fields[3]) > self.max_bytes:
+                data += '\n[truncated to {} bytes]\n'.format(
+                    self.max_bytes).encode('utf-8')
+            logs[path] = logs.get(path, b'') + data
+        return logs
+
+    @timing.timed('logs.finish')
+    def finish(self, hosts=None):
+        """Return {(host, file): bytes appended since start()}.
+
+        `hosts` defaults to the ones given to start().
+        """
+        if hosts is None:
+            hosts = list(self.offsets)
+        logs = {}
+        for host, host_logs in self._run(self._fetch, hosts).items():
+            for path, data in host_logs.items():
+                if data:
+                    logs[(host, path)] = data
+        return logs
+
+
+class LogHarvestMixin(object):
+    """Attaches the log lines written during each test to its result.
+
+    Depending on `log_harvest`, the logs are attached never, only when
+    the test fails, or always. They are collected from the hosts returned
+    by _log_harvest_hosts(), and from the ones the test adds with
+    _log_harvest_add_hosts() once it knows them, e.g. the computes hosting
+    its servers.
+    """
+
+    # None while the logs are not harvested.
+    _log_harvester = None
+
+    def _log_harvest_hosts(self):
+        return routing.get_controllers()
+
+    def _log_harvest_add_hosts(self, hosts):
+        """Also collect the logs written on `hosts` from now on."""
+        if self._log_harvester is None:
+            return
+        hosts = set(hosts) - set(self._log_harvester.offsets)
+        if hosts:
+            self._log_harvester.start(hosts)
+
+    def setUp(self):
+        super(LogHarvestMixin, self).setUp()
+        mode = CONF.compute_private_config.log_harvest
+        if mode == 'never':
+            return
+        self._log_harvest_failed = False
+        if mode == 'on_failure':
+            self.addOnException(self._log_harvest_on_exception)
+        self._log_harvester = LogHarvester(
+            CONF.compute_private_config.log_harvest_files,
+            CONF.compute_private_config.log_harvest_max_bytes)
+        try:
+            self._log_harvester.start(self._log_harvest_hosts())
+        except Exception:
+            LOG.exception('Unable to start harvesting logs')
+            self._log_harvester = None
+            return
+        self.addCleanup(self._attach_logs, mode)
+
+    def _log_harvest_on_exception(self, exc_info):
+        if not issubclass(exc_info[0], self.skipException):
+            self._log_harvest_failed = True
+
+    def _attach_logs(self, mode):
+        if mode == 'on_failure' and not self._log_harvest_failed:
+            return
+        for (host, path), data in sorted(
+                self._log_harvester.finish().items()):
+            self.addDetail('log {}:{}'.format(host, path),
+                           content.text_content(
+                               data.decode('utf-8', 'replace')))
@@ -0,0 +1,141 @@
+# Copyright 2016 Red Hat
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""Opt-in cProfile profiling of the plugin tests.
+
+When `profile_output_dir` is set, each test, including its setUp and
+cleanups, runs under cProfile and its profile is written to
+`<profile_output_dir>/<test id>.prof`. With `profile_class_setup`, the
+class setup and teardown are profiled to `<class id>.setUpClass.prof`
+and `<class id>.tearDownClass.prof` as well. Only the thread running the
+test is profiled, not the helper threads of concurrent SSH commands.
+Running this module on that directory prints the hot functions of the
+whole run:
+
+    python -m rhostest_tempest_plugin.lib.profiling <profile_output_dir>
+        [--sort cumulative] [--limit 40] [--output merged.prof]
+"""
+import argparse
+import cProfile
+import glob
+import os
+import pstats
+import re
+
+import six
+from tempest import config
+from testtools import content
+
+CONF = config.CONF
+
+# Functions attached to each test result.
+DETAIL_LIMIT = 20
+
+
+def profile_path(directory, name):
+    """Return the profile file of test or class `name` in `directory`."""
+    return os.path.join(directory,
+                        '{}.prof'.format(re.sub(r'[^\w.-]', '_', name)))
+
+
+def report(stats, sort='cumulative', limit=DETAIL_LIMIT):
+    """Return the `limit` first functions of `stats` by `sort`, as text."""
+    stream = six.StringIO()
+    stats.stream = stream
+    stats.sort_stats(sort).print_stats(limit)
+    return stream.getvalue()
+
+
+def _start():
+    profiler = cProfile.Profile()
+    profiler.enable()
+    return profiler
+
+
+class ProfilingMixin(object):
+    """Profiles each test, and optionally its class setup and teardown.
+
+    The class setup and teardown are profiled around setUpClass() and
+    tearDownClass(), so that the resource_setup() and resource_cleanup()
+    of the subclasses are included.
+    """
+
+    # Profiler of the class setup or teardown running. When the setup
+    # fails, tempest calls tearDownClass() from setUpClass(): the teardown
+    # is then part of the setup profile, cProfile profilers do not nest.
+    _class_profiler = None
+
+    @classmethod
+    def _profile_class_phase(cls, phase, func):
+        directory = CONF.compute_private_config.profile_output_dir
+        if (not (directory and
+                 CONF.compute_private_config.profile_class_setup) or
+                ProfilingMixin._class_profiler is not None):
+            return func()
+        profiler = ProfilingMixin._class_profiler = _start()
+        try:
+            return func()
+        finally:
+            profiler.disable()
+            ProfilingMixin._class_profiler = None
+            profiler.dump_stats(profile_path(
+                directory, '{}.{}.{}'.format(cls.__module__, cls.__name__,
+                                             phase)))
+
+    @classmethod
+    def setUpClass(cls):
+        cls._profile_class_phase(
+            'setUpClass', super(ProfilingMixin, cls).setUpClass)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls._profile_class_phase(
+            'tearDownClass', super(ProfilingMixin, cls).tearDownClass)
+
+    def setUp(self):
+        directory = CONF.compute_private_config.profile_output_dir
+        if directory:
+            # Registered before the other cleanups, so they are profiled
+            # too.
+            self.addCleanup(self._dump_profile, directory, _start())
+        super(ProfilingMixin, self).setUp()
+
+    def _dump_profile(self, directory, profiler):
+        profiler.disable()
+        profiler.dump_stats(profile_path(directory, self.id()))
+        self.addDetail('rhos-profile', content.text_content(
+            report(pstats.Stats(profiler))))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('directory', help='profile_output_dir of the run')
+    parser.add_argument('--sort', default='cumulative',
+                        help='pstats sort key, e.g. cumulative or tottime')
+    parser.add_argument('--limit', type=int, default=40)
+    parser.add_argument('--output', help='also write the merged profile')
+    args = parser.parse_args(argv)
+
+    paths = sorted(glob.glob(os.path.join(args.directory, '*.prof')))
+    if not paths:
+        parser.error('no profile in {}'.format(args.directory))
+    stats = pstats.Stats(*paths)
+    if args.output:
+        stats.dump_stats(args.output)
+    print('{} profiles'.format(len(paths)))
+    print(report(stats, args.sort, args.limit))
+
+
+if __name__ == '__main__':
+    main()
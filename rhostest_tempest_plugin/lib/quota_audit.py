@@ -0,0 +1,102 @@
+# Copyright 2016 Red Hat
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""Audit of the nova quota usages against the instances.
+
+The expected usages are aggregated from the instances table by the db,
+per project and user, and joined with quota_usages there, so only the
+usages which drifted are returned, whatever the size of the cloud.
+"""
+
+# In use instances, cores and ram, per project and user.
+_EXPECTED = """
+SELECT project_id, user_id,
+       COUNT(*) AS instances,
+       SUM(vcpus) AS cores,
+       SUM(memory_mb) AS ram
+FROM instances
+WHERE deleted = 0 {project_filter}
+GROUP BY project_id, user_id
+"""
+
+# Usages whose in_use differs from the instances, and users with instances
+# but no instances usage at all (in_use NULL). Usages with reservations in
+# flight are skipped.
+AUDIT_SQL = """
+SELECT project_id, user_id, resource, in_use, expected FROM (
+    SELECT usages.project_id, usages.user_id, usages.resource,
+           usages.in_use,
+           CASE usages.resource
+           WHEN 'instances' THEN COALESCE(counted.instances, 0)
+           WHEN 'cores' THEN COALESCE(counted.cores, 0)
+           WHEN 'ram' THEN COALESCE(counted.ram, 0)
+           END AS expected
+    FROM quota_usages usages
+    LEFT JOIN ({expected}) counted
+    ON counted.project_id = usages.project_id
+    AND counted.user_id = usages.user_id
+    WHERE usages.deleted = 0 AND usages.reserved = 0
+    AND usages.resource IN ('instances', 'cores', 'ram')
+    {usages_filter}
+) audit
+WHERE in_use <> expected
+UNION ALL
+SELECT counted.project_id, counted.user_id, 'instances', NULL,
+       counted.instances
+FROM ({expected}) counted
+LEFT JOIN quota_usages usages
+ON usages.project_id = counted.project_id
+AND usages.user_id = counted.user_id
+AND usages.resource = 'instances'
+AND usages.deleted = 0
+WHERE usages.resource IS NULL
+"""
+
+
+def audit_query(project_ids=None):
+    """Return the audit statement and its params.
+
+    Limited to `project_ids` if given, all the projects otherwise.
+    """
+    if not project_ids:
+        return AUDIT_SQL.format(
+            expected=_EXPECTED.format(project_filter=''),
+            usages_filter=''), None
+    placeholders = ', '.join(['%s'] * len(project_ids))
+    statement = AUDIT_SQL.format(
+        expected=_EXPECTED.format(
+            project_filter='AND project_id IN ({})'.format(placeholders)),
+        usages_filter='AND usages.project_id IN ({})'.format(placeholders))
+    # Both counts of the instances and the usages are filtered.
+    params = tuple(project_ids) * 3
+    return statement, params
+
+
+def _as_int(value):
+    return None if value is None else int(value)
+
+
+def find_mismatches(db_client, project_ids=None):
+    """Return the quota usages not matching the instances.
+
+    :returns: a list of {'project_id', 'user_id', 'resource', 'in_use',
+        'expected'} dicts, in_use being None for missing usages.
+    """
+    statement, params = audit_query(project_ids)
+    return [{'project_id': row['project_id'],
+             'user_id': row['user_id'],
+             'resource': row['resource'],
+             'in_use': _as_int(row['in_use']),
+             'expected': _as_int(row['expected'])}
+            for row in db_client.execute_query(statement, params)]
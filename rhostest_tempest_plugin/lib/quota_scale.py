@@ -0,0 +1,241 @@
+# Copyright 2016 Red Hat
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""`nova-manage project quota_usage_refresh` at scale.
+
+Seeds the nova db with many projects, each with instance rows and stale
+quota usages, refreshes all the projects concurrently and measures the
+refresh latencies and the load put on the db. The seeded rows all belong
+to projects named PROJECT_PREFIX-<n> and are deleted afterwards.
+"""
+import time
+import uuid
+
+from oslo_log import log as logging
+
+from rhostest_tempest_plugin.lib import concurrency
+from rhostest_tempest_plugin.lib import timing
+
+LOG = logging.getLogger(__name__)
+
+PROJECT_PREFIX = 'rhos-scale'
+USER_ID = 'rhos-scale-user'
+RESOURCES = ('instances', 'cores', 'ram')
+VCPUS = 1
+MEMORY_MB = 512
+# The usages are seeded with a value the refresh can never compute.
+STALE_IN_USE = -1
+# Rows per INSERT statement, and statements per round trip. The statements
+# of a round trip end up in a single argument of the mysql cli, which has
+# to stay well under the 128KiB limit of Linux.
+INSERT_BATCH = 200
+STATEMENTS_PER_CALL = 4
+
+# Tables of a local db stand-in, with the columns the refresh uses.
+SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS instances (
+        uuid VARCHAR(36) NOT NULL,
+        project_id VARCHAR(255),
+        user_id VARCHAR(255),
+        vcpus INTEGER,
+        memory_mb INTEGER,
+        deleted INTEGER DEFAULT 0)""",
+    """CREATE TABLE IF NOT EXISTS quota_usages (
+        project_id VARCHAR(255),
+        user_id VARCHAR(255),
+        resource VARCHAR(255),
+        in_use INTEGER,
+        reserved INTEGER DEFAULT 0,
+        deleted INTEGER DEFAULT 0)""",
+]
+INDEXES = [
+    'CREATE INDEX instances_project_id_deleted_idx '
+    'ON instances (project_id, deleted)',
+    'CREATE INDEX quota_usages_project_id_idx ON quota_usages (project_id)',
+]
+
+# What quota_usage_refresh computes for the usages of a project and user.
+REFRESH_SQL = """
+UPDATE quota_usages SET in_use = (
+    SELECT COALESCE(CASE quota_usages.resource
+                    WHEN 'instances' THEN COUNT(*)
+                    WHEN 'cores' THEN SUM(instances.vcpus)
+                    WHEN 'ram' THEN SUM(instances.memory_mb)
+                    END, 0)
+    FROM instances
+    WHERE instances.project_id = quota_usages.project_id
+    AND instances.user_id = quota_usages.user_id
+    AND instances.deleted = 0)
+WHERE project_id = %s AND user_id = %s AND deleted = 0
+"""
+
+# MySQL status counters reported as the db load of a refresh run.
+DB_STATUS_VARIABLES = ('Questions', 'Com_select', 'Com_update',
+                       'Innodb_rows_read', 'Innodb_rows_updated',
+                       'Innodb_row_lock_time')
+
+
+def project_id(index):
+    return '{}-{}'.format(PROJECT_PREFIX, index)
+
+
+def create_schema(db_client):
+    """Create the tables of a local db stand-in, if missing."""
+    db_client.execute_queries(SCHEMA)
+    for statement in INDEXES:
+        try:
+            db_client.execute_queries([statement])
+        except Exception:
+            LOG.debug('Not creating index, it probably exists: %s',
+                      statement)
+
+
+def delete_seeded(db_client):
+    pattern = PROJECT_PREFIX + '-%'
+    db_client.execute_queries([
+        ('DELETE FROM quota_usages WHERE project_id LIKE %s', (pattern,)),
+        ('DELETE FROM instances WHERE project_id LIKE %s', (pattern,))])
+
+
+def _insert_statements(table, columns, rows):
+    placeholders = '({})'.format(', '.join(['%s'] * len(columns)))
+    for start in range(0, len(rows), INSERT_BATCH):
+        batch = rows[start:start + INSERT_BATCH]
+        statement = 'INSERT INTO {} ({}) VALUES {}'.format(
+            table, ', '.join(columns), ', '.join([placeholders] * len(batch)))
+        yield statement, tuple(value for row in batch for value in row)
+
+
+def seed(db_client, projects, instances_per_project):
+    """Insert the instances and stale usages of `projects` projects.
+
+    Returns the number of rows inserted.
+    """
+    instances = [(str(uuid.uuid4()), project_id(index), USER_ID, VCPUS,
+                  MEMORY_MB, 0)
+                 for index in range(projects)
+                 for _ in range(instances_per_project)]
+    usages = [(project_id(index), USER_ID, resource, STALE_IN_USE, 0, 0)
+              for index in range(projects)
+              for resource in RESOURCES]
+    statements = list(_insert_statements(
+        'instances',
+        ('uuid', 'project_id', 'user_id', 'vcpus', 'memory_mb', 'deleted'),
+        instances))
+    statements.extend(_insert_statements(
+        'quota_usages',
+        ('project_id', 'user_id', 'resource', 'in_use', 'reserved',
+         'deleted'),
+        usages))
+    for start in range(0, len(statements), STATEMENTS_PER_CALL):
+        db_client.execute_queries(
+            statements[start:start + STATEMENTS_PER_CALL])
+    return len(instances) + len(usages)
+
+
+def stale_usages(db_client):
+    """Return the number of seeded usages not refreshed."""
+    rows = db_client.execute_query(
+        'SELECT COUNT(*) AS stale FROM quota_usages '
+        'WHERE project_id LIKE %s AND in_use = %s',
+        (PROJECT_PREFIX + '-%', STALE_IN_USE))
+    return int(rows[0]['stale'])
+
+
+def db_status(db_client):
+    """Return the DB_STATUS_VARIABLES counters, {} if unavailable."""
+    try:
+        rows = db_client.execute_query(
+            'SHOW GLOBAL STATUS WHERE Variable_name IN ({})'.format(
+                ', '.join(['%s'] * len(DB_STATUS_VARIABLES))),
+            DB_STATUS_VARIABLES)
+    except Exception:
+        LOG.debug('db status counters unavailable', exc_info=True)
+        return {}
+    return dict((row['Variable_name'], int(row['Value'])) for row in rows)
+
+
+def nova_manage_refresh(nova_manage_client):
+    """Refresh a project the way operators do."""
+    def refresh(project):
+        nova_manage_client.execute_command(
+            'project quota_usage_refresh --project {} --user {}'.format(
+                project, USER_ID))
+    return refresh
+
+
+def emulated_refresh(db_client):
+    """Refresh a project with the SQL equivalent of nova-manage."""
+    def refresh(project):
+        db_client.execute_queries([(REFRESH_SQL, (project, USER_ID))])
+    return refresh
+
+
+def _timed(refresh):
+    def call(project):
+        start = time.time()
+        refresh(project)
+        duration = time.time() - start
+        timing.RECORDER.record('quota_scale.refresh', duration)
+        return duration
+    return call
+
+
+def measure(db_client, refresh, projects, instances_per_project,
+            workers=concurrency.DEFAULT_WORKERS):
+    """Seed `projects` projects, refresh them all and report on it.
+
+    `refresh` is called with each project id, from `workers` threads.
+    The seeded rows are deleted before returning.
+    """
+    delete_seeded(db_client)
+    try:
+        start = time.time()
+        rows = seed(db_client, projects, instances_per_project)
+        seed_time = time.time() - start
+
+        status_before = db_status(db_client)
+        start = time.time()
+        outcomes = concurrency.run_concurrently(
+            _timed(refresh), [project_id(index) for index in range(projects)],
+            workers)
+        wall_time = time.time() - start
+        status_after = db_status(db_client)
+
+        failures = [outcome for outcome in outcomes
+                    if outcome.error is not None]
+        for outcome in failures[:5]:
+            LOG.error('Refreshing %s failed', outcome.item,
+                      exc_info=outcome.exc_info)
+        latencies = sorted(outcome.result for outcome in outcomes
+                           if outcome.error is None)
+        stale = stale_usages(db_client)
+    finally:
+        delete_seeded(db_client)
+
+    report = {'projects': projects,
+              'rows_seeded': rows,
+              'seed_seconds': seed_time,
+              'failures': len(failures),
+              'stale_usages': stale,
+              'refresh_wall_seconds': wall_time,
+              'refreshes_per_second': len(latencies) / wall_time,
+              'db_load': dict((name, status_after[name] - value)
+                              for name, value in status_before.items()
+                              if name in status_after)}
+    if latencies:
+        report.update(('refresh_' + name, timing.percentile(latencies, pct))
+                      for name, pct in (('p50', 50), ('p95', 95),
+                                        ('p99', 99)))
+    return report
@@ -0,0 +1,185 @@
+# Copyright 2016 Red Hat
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""Partition the plugin tests across the workers of a parallel run.
+
+Test classes declare the resources they set up per worker, or must not
+use concurrently, in their `shared_fixtures` attribute, e.g. the nova db
+connection and quota usages. Resources already shared by all the workers,
+like the pooled flavors, are not declared. Classes sharing a fixture,
+directly or through another class, are scheduled on the same worker so
+that the fixture is only set up once. The groups are then balanced
+across the workers by the runtime of their tests in previous runs, as
+dumped to `timing_output_dir`, longest first. The partition is written
+as a stestr worker file:
+
+    python -m rhostest_tempest_plugin.lib.scheduling --workers 4
+        [--timings <timing_output_dir>] [--output workers.yaml]
+    stestr run --worker-file workers.yaml
+"""
+import argparse
+import collections
+import glob
+import json
+import os
+import re
+import sys
+import unittest
+
+# Runtime assumed for the tests without history, when no test has any.
+DEFAULT_RUNTIME = 10.0
+
+# Phase recorded by timing.TimingMixin for the whole test.
+TEST_PHASE = 'test'
+
+
+def iter_tests(suite):
+    """Yield the test cases of a possibly nested test suite."""
+    for test in suite:
+        if isinstance(test, unittest.TestSuite):
+            for case in iter_tests(test):
+                yield case
+        else:
+            yield test
+
+
+def _class_id(test):
+    return '{}.{}'.format(type(test).__module__, type(test).__name__)
+
+
+def _test_name(test_id):
+    # Tempest appends the test attributes, e.g. "[id-...,smoke]".
+    return test_id.split('[', 1)[0]
+
+
+def discover():
+    """Return {class id: (fixtures, [test ids])} of the plugin tests."""
+    from rhostest_tempest_plugin import plugin
+
+    test_dir, top_dir = plugin.RHOSTempestPlugin().load_tests()
+    classes = collections.OrderedDict()
+    for test in iter_tests(unittest.TestLoader().discover(
+            test_dir, top_level_dir=top_dir)):
+        _, test_ids = classes.setdefault(
+            _class_id(test),
+            (frozenset(getattr(test, 'shared_fixtures', ())), []))
+        test_ids.append(_test_name(test.id()))
+    return classes
+
+
+def load_runtimes(directory):
+    """Return {test id: mean runtime} from the timing dumps of `directory`."""
+    durations = collections.defaultdict(list)
+    for path in glob.glob(os.path.join(directory, 'rhos-timings-*.json')):
+        with open(path) as dump_file:
+            for test_id, phases in json.load(dump_file).items():
+                durations[_test_name(test_id)].extend(
+                    phases.get(TEST_PHASE, ()))
+    return dict((test_id, sum(values) / len(values))
+                for test_id, values in durations.items() if values)
+
+
+def group_classes(classes):
+    """Group the classes sharing fixtures, transitively.
+
+    :param classes: {class id: (fixtures, [test ids])}
+    :returns: a list of lists of class ids.
+    """
+    # Union-find: each fixture links its classes to the first one which
+    # declared it.
+    parents = dict((class_id, class_id) for class_id in classes)
+
+    def find(class_id):
+        while parents[class_id] != class_id:
+            parents[class_id] = parents[parents[class_id]]
+            class_id = parents[class_id]
+        return class_id
+
+    holders = {}
+    for class_id, (fixtures, _) in classes.items():
+        for fixture in fixtures:
+            holder = holders.setdefault(fixture, class_id)
+            parents[find(class_id)] = find(holder)
+    groups = collections.OrderedDict()
+    for class_id in classes:
+        groups.setdefault(find(class_id), []).append(class_id)
+    return list(groups.values())
+
+
+def partition(classes, workers, runtimes=None):
+    """Balance the fixture groups across `workers` workers.
+
+    Each group goes, longest first, to the worker with the least runtime
+    so far. Tests without history count for the mean runtime of the ones
+    with some. Groups are never split, so a group longer than a worker's
+    share of the run makes the partition unbalanced.
+
+    :returns: a list, per worker, of (runtime, [class ids]), without the
+        empty workers.
+    """
+    runtimes = runtimes or {}
+    known = [runtimes[test_id] for _, test_ids in classes.values()
+             for test_id in test_ids if test_id in runtimes]
+    default = sum(known) / len(known) if known else DEFAULT_RUNTIME
+
+    def runtime(class_ids):
+        return sum(runtimes.get(test_id, default)
+                   for class_id in class_ids
+                   for test_id in classes[class_id][1])
+
+    loads = [(0.0, []) for _ in range(workers)]
+    weighted = sorted(((runtime(group), group)
+                       for group in group_classes(classes)),
+                      key=lambda item: -item[0])
+    for group_runtime, group in weighted:
+        index = min(range(workers), key=lambda i: loads[i][0])
+        total, class_ids = loads[index]
+        loads[index] = (total + group_runtime, class_ids + group)
+    return [load for load in loads if load[1]]
+
+
+def worker_file(loads):
+    """Return the stestr worker file running each load on its own worker."""
+    lines = []
+    for _, class_ids in loads:
+        lines.append('- worker:')
+        for class_id in class_ids:
+            regex = '^{}\\.'.format(re.escape(class_id))
+            lines.append("  - '{}'".format(regex.replace("'", "''")))
+    return '\n'.join(lines) + '\n'
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--workers', type=int, required=True)
+    parser.add_argument('--timings',
+                        help='timing_output_dir of previous runs')
+    parser.add_argument('--output', help='worker file, stdout by default')
+    args = parser.parse_args(argv)
+
+    classes = discover()
+    runtimes = load_runtimes(args.timings) if args.timings else {}
+    loads = partition(classes, args.workers, runtimes)
+    for index, (total, class_ids) in enumerate(loads):
+        sys.stderr.write('worker {}: {:.1f}s, {} classes\n'.format(
+            index, total, len(class_ids)))
+    if args.output:
+        with open(args.output, 'w') as output:
+            output.write(worker_file(loads))
+    else:
+        sys.stdout.write(worker_file(loads))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,196 @@
+# Copyright 2016 Red Hat
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+import atexit
+import collections
+import threading
+import time
+
+from oslo_log import log as logging
+from tempest.common.utils import data_utils
+from tempest import config
+from tempest.lib.common.utils import test_utils
+from tempest.lib import exceptions
+
+from rhostest_tempest_plugin.lib import timing
+from rhostest_tempest_plugin.lib import waiters
+from rhostest_tempest_plugin.services import admin
+
+
+CONF = config.CONF
+LOG = logging.getLogger(__name__)
+
+
+class ServerPool(object):
+    """ACTIVE servers shared by read-only tests of a run.
+
+    Servers are pooled per (flavor, image, metadata). A test leases a
+    server, and releases it when done; a released server goes back to the
+    pool unless the test marked it dirty. The first lease of each kind
+    boots `prewarm` servers at once. The pool keeps at most `max_idle`
+    servers per key and deletes all its servers when the process exits.
+
+    Servers outlive the test classes leasing them, so they are booted and
+    deleted with `client`, by default the servers client of the run's
+    admin manager, in the project of the configured admin.
+    """
+
+    def __init__(self, max_idle=4, prewarm=1, client=None):
+        self.max_idle = max_idle
+        self.prewarm_count = prewarm
+        self._client = client
+        self._idle = collections.defaultdict(list)
+        # server id -> [key, dirty]
+        self._leased = {}
+        self._prewarmed = set()
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = admin.get_admin_manager().servers_client
+        return self._client
+
+    @staticmethod
+    def _key(flavor, image, metadata):
+        if flavor is None:
+            flavor = CONF.compute.flavor_ref
+        if image is None:
+            image = CONF.compute.image_ref
+        return flavor, image, tuple(sorted((metadata or {}).items()))
+
+    @timing.timed('server.boot')
+    def _boot(self, count, key):
+        flavor, image, metadata = key
+        kwargs = {}
+        if metadata:
+            kwargs['metadata'] = dict(metadata)
+        since = waiters.changes_since(time.time())
+        reservation_id = self.client.create_server(
+            name=data_utils.rand_name('rhos-pool'),
+            imageRef=image,
+            flavorRef=flavor,
+            networks=[{'uuid': CONF.network.public_network_id}],
+            min_count=count,
+            max_count=count,
+            return_reservation_id=True,
+            **kwargs)['reservation_id']
+        server_ids = [server['id'] for server in self.client.list_servers(
+            reservation_id=reservation_id)['servers']]
+        try:
+            waiters.wait_for_servers_status(self.client, server_ids,
+                                            'ACTIVE', since=since)
+        except Exception:
+            for server_id in server_ids:
+                self._delete(server_id)
+            raise
+        return server_ids
+
+    def prewarm(self, count, flavor=None, image=None, metadata=None):
+        """Boot servers until `count` of this kind are idle in the pool."""
+        key = self._key(flavor, image, metadata)
+        with self._lock:
+            missing = count - len(self._idle[key])
+        if missing <= 0:
+            return
+        server_ids = self._boot(missing, key)
+        with self._lock:
+            self._idle[key].extend(server_ids)
+
+    def _take_idle(self, key):
+        while True:
+            with self._lock:
+                if not self._idle[key]:
+                    return None
+                server_id = self._idle[key].pop()
+            try:
+                server = self.client.show_server(server_id)['server']
+            except exceptions.NotFound:
+                LOG.warning('Pooled server %s is gone', server_id)
+                continue
+            if server['status'] == 'ACTIVE':
+                return server_id
+            LOG.warning('Pooled server %s is %s, recycling it', server_id,
+                        server['status'])
+            self._delete(server_id)
+
+    def lease(self, flavor=None, image=None, metadata=None):
+        """Return the id of an ACTIVE server, booting one if none is idle."""
+        key = self._key(flavor, image, metadata)
+        with self._lock:
+            prewarm = key not in self._prewarmed
+            self._prewarmed.add(key)
+        if prewarm:
+            self.prewarm(self.prewarm_count, flavor, image, metadata)
+        server_id = self._take_idle(key)
+        if server_id is None:
+            server_id = self._boot(1, key)[0]
+        with self._lock:
+            self._leased[server_id] = [key, False]
+        return server_id
+
+    def mark_dirty(self, server_id):
+        """Flag a leased server as modified, so it is not reused."""
+        with self._lock:
+            self._leased[server_id][1] = True
+
+    def release(self, server_id, dirty=False):
+        with self._lock:
+            key, marked_dirty = self._leased.pop(server_id)
+            if not (dirty or marked_dirty or
+                    len(self._idle[key]) >= self.max_idle):
+                self._idle[key].append(server_id)
+                return
+        self._delete(server_id)
+
+    def _delete(self, server_id):
+        try:
+            test_utils.call_and_ignore_notfound_exc(
+                self.client.delete_server, server_id)
+        except Exception:
+            LOG.exception('Deleting pooled server %s failed', server_id)
+
+    def cleanup(self):
+        """Delete all the servers of the pool."""
+        with self._lock:
+            server_ids = list(self._leased)
+            for idle in self._idle.values():
+                server_ids.extend(idle)
+            self._idle.clear()
+            self._leased.clear()
+        if not server_ids:
+            return
+        LOG.debug('Clearing pooled servers: %s', ','.join(server_ids))
+        for server_id in server_ids:
+            self._delete(server_id)
+        try:
+            waiters.wait_for_servers_termination(self.client, server_ids)
+        except Exception:
+            LOG.exception('Waiting for deletion of pooled servers failed')
+
+
+_POOL = None
+_POOL_LOCK = threading.Lock()
+
+
+def get_server_pool():
+    """Return the process wide server pool."""
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL is None:
+            opts = CONF.compute_private_config
+            _POOL = ServerPool(max_idle=opts.server_pool_max_idle,
+                               prewarm=opts.server_pool_prewarm)
+            atexit.register(_POOL.cleanup)
+        return _POOL
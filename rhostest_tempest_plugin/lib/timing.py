@@ -0,0 +1,177 @@
+# Copyright 2016 Red Hat
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""Per-phase timing of the plugin's slow operations.
+
+Durations are recorded against the test currently running in the process,
+including the ones of helper threads, and attached to the test results as
+the `rhos-timings` detail. When `timing_output_dir` is set, each worker
+also dumps all its durations to a JSON file when it exits. Running this
+module on that directory prints the run summary:
+
+    python -m rhostest_tempest_plugin.lib.timing <timing_output_dir>
+"""
+import atexit
+import collections
+import contextlib
+import functools
+import glob
+import json
+import math
+import os
+import sys
+import threading
+import time
+
+from tempest import config
+from testtools import content
+
+CONF = config.CONF
+
+NO_TEST = '<no test>'
+
+
+class TimingRecorder(object):
+    """Records the durations of named phases, per test."""
+
+    def __init__(self):
+        self.current_test = NO_TEST
+        # test id -> phase -> [durations]
+        self._durations = collections.defaultdict(
+            lambda: collections.defaultdict(list))
+        self._lock = threading.Lock()
+
+    def record(self, phase, duration):
+        with self._lock:
+            self._durations[self.current_test][phase].append(duration)
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.record(name, time.time() - start)
+
+    @contextlib.contextmanager
+    def scope(self, test_id):
+        """Attribute the phases recorded in the block to `test_id`."""
+        previous, self.current_test = self.current_test, test_id
+        try:
+            yield
+        finally:
+            self.current_test = previous
+
+    def test_summary(self, test_id):
+        """Return {phase: {'count': n, 'total': seconds}} for a test."""
+        with self._lock:
+            phases = self._durations.get(test_id, {})
+            return dict((phase, {'count': len(durations),
+                                 'total': sum(durations)})
+                        for phase, durations in phases.items())
+
+    def dump(self, path):
+        with self._lock:
+            with open(path, 'w') as dump_file:
+                json.dump(self._durations, dump_file)
+
+
+def percentile(durations, percent):
+    """Nearest-rank percentile of a sorted list."""
+    rank = int(math.ceil(percent / 100.0 * len(durations)))
+    return durations[min(max(rank, 1), len(durations)) - 1]
+
+
+def summarize(dumps):
+    """Merge recorder dumps into per phase count/total/p50/p95/p99."""
+    phases = collections.defaultdict(list)
+    for durations in dumps:
+        for test_phases in durations.values():
+            for phase, values in test_phases.items():
+                phases[phase].extend(values)
+    summary = {}
+    for phase, values in phases.items():
+        values.sort()
+        summary[phase] = {'count': len(values),
+                          'total': sum(values),
+                          'p50': percentile(values, 50),
+                          'p95': percentile(values, 95),
+                          'p99': percentile(values, 99)}
+    return summary
+
+
+RECORDER = TimingRecorder()
+
+
+def timed(phase):
+    """Decorator recording the duration of each call as `phase`."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with RECORDER.phase(phase):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+_DUMP_ENABLED = []
+
+
+def enable_dump(directory):
+    """Dump the durations of this process to `directory` at exit."""
+    if _DUMP_ENABLED:
+        return
+    _DUMP_ENABLED.append(directory)
+    path = os.path.join(directory, 'rhos-timings-{}.json'.format(os.getpid()))
+    atexit.register(RECORDER.dump, path)
+
+
+class TimingMixin(object):
+    """Attributes the recorded phases to each test and attaches them."""
+
+    def setUp(self):
+        super(TimingMixin, self).setUp()
+        if CONF.compute_private_config.timing_output_dir:
+            enable_dump(CONF.compute_private_config.timing_output_dir)
+        previous, RECORDER.current_test = RECORDER.current_test, self.id()
+        # Registered first, so it runs after the other cleanups and their
+        # phases are included.
+        self.addCleanup(self._attach_timings, previous, time.time())
+
+    def _attach_timings(self, previous, start):
+        # The whole test, used by scheduling to balance the next runs.
+        RECORDER.record('test', time.time() - start)
+        RECORDER.current_test = previous
+        summary = RECORDER.test_summary(self.id())
+        if summary:
+            self.addDetail('rhos-timings', content.json_content(summary))
+
+
+def main(argv):
+    dumps = []
+    for path in glob.glob(os.path.join(argv[1], 'rhos-timings-*.json')):
+        with open(path) as dump_file:
+            dumps.append(json.load(dump_file))
+    summary = summarize(dumps)
+    print('{:<30} {:>7} {:>10} {:>8} {:>8} {:>8}'.format(
+        'phase', 'count', 'total', 'p50', 'p95', 'p99'))
+    for phase in sorted(summary, key=lambda p: -summary[p]['total']):
+        stats = summary[phase]
+        print('{:<30} {:>7} {:>10.2f} {:>8.3f} {:>8.3f} {:>8.3f}'.format(
+            phase, stats['count'], stats['total'], stats['p50'],
+            stats['p95'], stats['p99']))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
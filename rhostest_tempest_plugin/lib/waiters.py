@@ -0,0 +1,164 @@
+# Copyright 2016 Red Hat
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""Waiters tracking many servers with one listing per poll.
+
+Unlike tempest.common.waiters, which GETs each server separately, these
+waiters list the servers once per tick, with details, and check all the
+tracked servers against that listing, following its pages until all of
+them were seen or the listing ends. The poll interval grows
+exponentially, with jitter, up to `max_interval`, under a global deadline.
+"""
+import datetime
+import random
+import time
+
+from oslo_log import log as logging
+from six.moves.urllib import parse
+from tempest.lib import exceptions
+
+from rhostest_tempest_plugin.lib import timing
+
+
+LOG = logging.getLogger(__name__)
+
+BACKOFF_FACTOR = 1.5
+JITTER = 0.25
+# Margin applied to changes-since to cover clock skew with the API nodes.
+CHANGES_SINCE_MARGIN = 60
+
+
+def _intervals(initial, maximum):
+    interval = initial
+    while True:
+        yield random.uniform(interval * (1 - JITTER), interval)
+        interval = min(interval * BACKOFF_FACTOR, maximum)
+
+
+def changes_since(start_time):
+    """Format `start_time` for the changes-since filter of list_servers."""
+    since = datetime.datetime.utcfromtimestamp(
+        start_time - CHANGES_SINCE_MARGIN)
+    return since.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def _next_marker(body):
+    for link in body.get('servers_links', ()):
+        if link.get('rel') == 'next':
+            markers = parse.parse_qs(
+                parse.urlparse(link['href']).query).get('marker')
+            if markers:
+                return markers[0]
+    return None
+
+
+def _list_servers(client, server_ids, list_params):
+    """Return {id: server} of the listed servers among `server_ids`.
+
+    The listing is paginated by the API past osapi_max_limit servers, the
+    next pages are fetched until all of `server_ids` were seen.
+    """
+    listed = {}
+    params = dict(list_params)
+    while True:
+        body = client.list_servers(detail=True, **params)
+        listed.update((server['id'], server) for server in body['servers']
+                      if server['id'] in server_ids)
+        marker = _next_marker(body)
+        if marker is None or len(listed) == len(server_ids):
+            return listed
+        params['marker'] = marker
+
+
+@timing.timed('server.wait')
+def _wait(client, server_ids, is_done, description, since=None,
+          timeout=None, interval=None, max_interval=None, **list_params):
+    timeout = client.build_timeout if timeout is None else timeout
+    interval = client.build_interval if interval is None else interval
+    max_interval = interval * 8 if max_interval is None else max_interval
+    if since is not None:
+        list_params['changes-since'] = since
+
+    start_time = time.time()
+    pending = set(server_ids)
+    times = {}
+    if not pending:
+        return times
+    for delay in _intervals(interval, max_interval):
+        listed = _list_servers(client, pending, list_params)
+        now = time.time()
+        for server_id in list(pending):
+            if is_done(server_id, listed.get(server_id)):
+                pending.discard(server_id)
+                times[server_id] = now - start_time
+        if not pending:
+            LOG.debug('Servers reached %s after: %s', description, times)
+            return times
+
+        remaining = start_time + timeout - now
+        if remaining <= 0:
+            raise exceptions.TimeoutException(
+                'Servers %s failed to reach %s within the required time '
+                '(%s s).' % (', '.join(sorted(pending)), description,
+                             timeout))
+        time.sleep(min(delay, remaining))
+
+
+def wait_for_servers_status(client, server_ids, status, since=None,
+                            timeout=None, interval=None, max_interval=None,
+                            **list_params):
+    """Wait for all of `server_ids` to reach `status`.
+
+    :param since: changes-since value narrowing the listing to the servers
+        updated since then, see changes_since(). Only use it for servers
+        created or acted on after that time.
+    :param list_params: extra list_servers filters, e.g. all_tenants.
+    :returns: the seconds each server took to reach `status`.
+    :raises BuildErrorException: as soon as a server goes to ERROR.
+    :raises TimeoutException: if some servers are not in `status` by the
+        deadline.
+    """
+    def is_done(server_id, server):
+        if server is None:
+            return False
+        if server['status'] == 'ERROR' and status != 'ERROR':
+            raise exceptions.BuildErrorException(server_id=server_id)
+        return server['status'] == status
+
+    return _wait(client, server_ids, is_done, '%s status' % status,
+                 since=since, timeout=timeout, interval=interval,
+                 max_interval=max_interval, **list_params)
+
+
+def wait_for_servers_termination(client, server_ids, since=None,
+                                 timeout=None, interval=None,
+                                 max_interval=None, **list_params):
+    """Wait for all of `server_ids` to be deleted.
+
+    Without `since`, a server missing from the listing is deleted. With
+    `since`, deleted servers are listed with the DELETED status and a
+    missing server is one that did not change.
+
+    :returns: the seconds each server took to go away.
+    """
+    def is_done(server_id, server):
+        if server is None:
+            return since is None
+        if server['status'] == 'ERROR':
+            raise exceptions.BuildErrorException(server_id=server_id)
+        return server['status'] == 'DELETED'
+
+    return _wait(client, server_ids, is_done, 'termination', since=since,
+                 timeout=timeout, interval=interval,
+                 max_interval=max_interval, **list_params)
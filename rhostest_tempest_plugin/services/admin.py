@@ -0,0 +1,38 @@
+# Copyright 2016 Red Hat
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+import threading
+
+_MANAGER = None
+_MANAGER_LOCK = threading.Lock()
+
+
+def get_admin_manager():
+    """Return the process wide client manager of the configured admin.
+
+    It uses the admin credentials of the [auth] section of tempest.conf.
+    Unlike the client managers of the test classes, whose dynamic
+    credentials are deleted when the class is torn down, it stays valid
+    until the process exits: the resources shared by the whole run are
+    handled with it.
+    """
+    global _MANAGER
+    with _MANAGER_LOCK:
+        if _MANAGER is None:
+            from tempest import clients
+            from tempest.common import credentials_factory
+
+            _MANAGER = clients.Manager(
+                credentials_factory.get_configured_admin_credentials())
+        return _MANAGER
@@ -12,29 +12,138 @@
 #    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
 #    License for the specific language governing permissions and limitations
 #    under the License.
+import collections
+import json
+import os
+import re
+import threading
+import time
 import urlparse
+import uuid
 
+from oslo_concurrency import lockutils
+from oslo_log import log as logging
+import six
+from six.moves import shlex_quote
 from tempest import config
-from tempest.lib.common import ssh
+
+from rhostest_tempest_plugin.lib import concurrency
+from rhostest_tempest_plugin.lib import domain_xml
+from rhostest_tempest_plugin.lib import timing
+from rhostest_tempest_plugin.services import db
+from rhostest_tempest_plugin.services import routing
+from rhostest_tempest_plugin.services import ssh_pool
 
 
 CONF = config.CONF
+LOG = logging.getLogger(__name__)
+
+# Database connection parameters discovered from nova.conf, per controller.
+_DB_CONNECTIONS = {}
+_DB_CONNECTIONS_LOCK = threading.Lock()
+
+# Parsed domain XML, per (host, domain, generation), least recently added
+# entries are dropped first.
+DOMAIN_CACHE_SIZE = 256
+_DOMAINS = collections.OrderedDict()
+_DOMAINS_LOCK = threading.Lock()
+
+# PyMySQL backends, per controller, shared by all the MySQLClients.
+_DB_BACKENDS = {}
+_DB_BACKENDS_LOCK = threading.Lock()
+
+# Statements routed to any controller.
+_READ_STATEMENTS = ('describe', 'explain', 'select', 'show')
+
+# Escape sequences used by the mysql cli in batch mode.
+_BATCH_ESCAPES = {'\\': '\\', 't': '\t', 'n': '\n', '0': '\0'}
 
 
 class SSHClient(object):
-    """A client to execute remote commands, based on tempest.lib.common.ssh."""
+    """A client to execute remote commands, based on tempest.lib.common.ssh.
+
+    Connections are taken from the process wide SSH connection pool, so
+    consecutive commands to the same host reuse the same SSH session.
+    """
 
     def __init__(self):
         self.ssh_key = CONF.compute_private_config.target_private_key_path
         self.ssh_user = CONF.compute_private_config.target_ssh_user
+        self.pool = ssh_pool.get_connection_pool()
+
+    @timing.timed('ssh.execute')
+    def execute(self, hostname=None, cmd=None, timeout=None,
+                connect_timeout=None):
+        return self.pool.execute(hostname, self.ssh_user, self.ssh_key, cmd,
+                                 timeout, connect_timeout)
 
-    def execute(self, hostname=None, cmd=None):
-        ssh_client = ssh.Client(hostname, self.ssh_user,
-                                key_filename=self.ssh_key)
-        return ssh_client.exec_command(cmd)
+    def iter_execute(self, hostname, cmd, timeout=None, max_bytes=None,
+                     lines=True):
+        """Yield the output of `cmd` as it is received, see execute().
+
+        Yields lines, without their line feed, or chunks of text if
+        `lines` is False, so large outputs are never held in memory at
+        once. Stopping the iteration early, e.g. once a line matched,
+        stops the command. ssh_pool.OutputLimitExceeded is raised after
+        `max_bytes` bytes, `ssh_stream_max_bytes` by default.
+        """
+        if max_bytes is None:
+            max_bytes = CONF.compute_private_config.ssh_stream_max_bytes
+        with timing.RECORDER.phase('ssh.stream'):
+            for item in self.pool.stream(hostname, self.ssh_user,
+                                         self.ssh_key, cmd, timeout,
+                                         max_bytes, lines):
+                yield item
+
+    def search(self, hostname, cmd, pattern, timeout=None, max_bytes=None):
+        """Return the first line of the output of `cmd` matching `pattern`.
+
+        The command is stopped as soon as the line is received. Returns
+        None if no line matched.
+        """
+        regex = re.compile(pattern)
+        lines = self.iter_execute(hostname, cmd, timeout, max_bytes)
+        try:
+            for line in lines:
+                if regex.search(line):
+                    return line
+        finally:
+            lines.close()
+        return None
+
+    def execute_on_hosts(self, hostnames, cmd, timeout=None,
+                         max_workers=None):
+        """Run `cmd` on all of `hostnames` concurrently.
+
+        At most `max_workers` hosts, `ssh_fanout_workers` by default, are
+        reached at a time, and `timeout` seconds are given to connecting
+        to each of them, then to the command itself. A failing or
+        unreachable host does not stop the others.
+
+        :returns: {hostname: concurrency.Outcome}, the outcome result being
+            the command output, its error the exception raised for that
+            host, e.g. SSHExecCommandFailed or TimeoutException.
+        """
+        if max_workers is None:
+            max_workers = CONF.compute_private_config.ssh_fanout_workers
+        outcomes = concurrency.run_concurrently(
+            lambda hostname: self.execute(hostname, cmd, timeout, timeout),
+            set(hostnames), max_workers)
+        for outcome in outcomes:
+            if outcome.error is not None:
+                LOG.warning('Command %r failed on %s: %s', cmd,
+                            outcome.item, outcome.error)
+        return dict((outcome.item, outcome) for outcome in outcomes)
 
 
 class VirshXMLClient(SSHClient):
+    """Retrieves libvirt domain XML from a compute node.
+
+    get_domain() parses the XML and caches it per (host, domain,
+    generation). Callers bump the generation when the domain definition is
+    expected to change, e.g. after a resize or a rebuild.
+    """
+
     def __init__(self, hostname=None):
         super(VirshXMLClient, self).__init__()
         self.host = hostname
@@ -43,39 +152,382 @@ class VirshXMLClient(SSHClient):
         command = "sudo virsh dumpxml {}".format(domain)
         return self.execute(self.host, command)
 
+    def get_domain(self, domain, generation=0):
+        """Return the parsed domain XML of `domain`."""
+        key = (self.host, domain, generation)
+        with _DOMAINS_LOCK:
+            if key in _DOMAINS:
+                return _DOMAINS[key]
+        parsed = domain_xml.DomainXML(self.dumpxml(domain))
+        with _DOMAINS_LOCK:
+            _DOMAINS[key] = parsed
+            while len(_DOMAINS) > DOMAIN_CACHE_SIZE:
+                _DOMAINS.popitem(last=False)
+        return parsed
+
+    @staticmethod
+    def get_domains(domains_by_host, generation=0,
+                    max_workers=concurrency.DEFAULT_WORKERS):
+        """Fetch many domains across many compute nodes concurrently.
+
+        :param domains_by_host: {host: [domain, ...]}
+        :returns: {(host, domain): DomainXML}. Domains that could not be
+            retrieved map to the raised exception instead.
+        """
+        pairs = [(host, domain)
+                 for host, domains in domains_by_host.items()
+                 for domain in domains]
+        outcomes = concurrency.run_concurrently(
+            lambda pair: VirshXMLClient(pair[0]).get_domain(pair[1],
+                                                            generation),
+            pairs, max_workers)
+        return dict((outcome.item, outcome.result
+                     if outcome.error is None else outcome.error)
+                    for outcome in outcomes)
+
+
+def _discover_db_connection(host):
+    """Read the nova db connection parameters from nova.conf on `host`."""
+    ssh_client = SSHClient()
+    cmd = 'grep "connection=mysql+pymysql://nova:" /etc/nova/nova.conf'
+    connection = ssh_client.execute(host, "sudo {}".format(cmd))
+    connection_url = "=".join(connection.split("=")[1:]).strip()
+    return _parse_db_connection(connection_url)
+
+
+def _parse_db_connection(connection_url):
+    p = urlparse.urlparse(connection_url)
+    return {'username': p.username,
+            'password': p.password,
+            'database': p.path[1:],
+            'hostname': p.hostname,
+            'port': p.port}
+
+
+def _load_db_connection_from_file(path, host, ttl):
+    try:
+        with open(path) as cache_file:
+            entry = json.load(cache_file).get(host)
+    except (IOError, ValueError):
+        return None
+    if entry is None or time.time() - entry['timestamp'] > ttl:
+        return None
+    return entry['params']
+
+
+def _save_db_connection_to_file(path, host, params):
+    try:
+        with open(path) as cache_file:
+            cache = json.load(cache_file)
+    except (IOError, ValueError):
+        cache = {}
+    cache[host] = {'timestamp': time.time(), 'params': params}
+    # The cache holds the db password, keep it private to the test user.
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'w') as cache_file:
+        json.dump(cache, cache_file)
+
+
+def get_db_connection(host):
+    """Return the nova db connection parameters used on `host`.
+
+    The parameters are discovered once per controller and per process. If
+    `db_discovery_cache_file` is set, they are also shared between
+    processes (e.g. parallel test workers) through that file, under an
+    external lock, and rediscovered once older than
+    `db_discovery_cache_ttl` seconds.
+    """
+    db_connection = CONF.compute_private_config.db_connection
+    if db_connection:
+        return _parse_db_connection(db_connection)
+
+    with _DB_CONNECTIONS_LOCK:
+        if host in _DB_CONNECTIONS:
+            return _DB_CONNECTIONS[host]
+
+        cache_path = CONF.compute_private_config.db_discovery_cache_file
+        if cache_path:
+            ttl = CONF.compute_private_config.db_discovery_cache_ttl
+            with lockutils.lock('rhostest-db-discovery', external=True,
+                                lock_path=os.path.dirname(
+                                    os.path.abspath(cache_path))):
+                params = _load_db_connection_from_file(cache_path, host, ttl)
+                if params is None:
+                    params = _discover_db_connection(host)
+                    _save_db_connection_to_file(cache_path, host, params)
+        else:
+            params = _discover_db_connection(host)
+        LOG.debug('Discovered db connection of %s: %s@%s', host,
+                  params['username'], params['database'])
+        _DB_CONNECTIONS[host] = params
+        return params
+
+
+def _get_pymysql_backend(host, connection, ssh_user, ssh_key):
+    """Return the PyMySQL backend for `host`, None if it is unusable."""
+    with _DB_BACKENDS_LOCK:
+        if host not in _DB_BACKENDS:
+            if CONF.compute_private_config.db_connection:
+                # Explicit connection, e.g. a local stand-in: no tunnel.
+                tunnel_through = None
+            else:
+                tunnel_through = (host, ssh_user, ssh_key)
+            try:
+                _DB_BACKENDS[host] = db.PyMySQLBackend(
+                    connection['hostname'] or '127.0.0.1',
+                    connection['port'],
+                    connection['username'],
+                    connection['password'],
+                    connection['database'],
+                    pool_size=CONF.compute_private_config.db_pool_size,
+                    tunnel_through=tunnel_through)
+            except Exception:
+                LOG.warning('PyMySQL db backend unavailable for %s, falling '
+                            'back to the mysql cli', host, exc_info=True)
+                _DB_BACKENDS[host] = None
+        return _DB_BACKENDS[host]
+
+
+def _sql_literal(value):
+    if value is None:
+        return 'NULL'
+    if isinstance(value, bool):
+        return str(int(value))
+    if isinstance(value, six.integer_types):
+        return str(value)
+    if isinstance(value, float):
+        return repr(value)
+    value = six.text_type(value)
+    for char, escaped in (('\\', '\\\\'), ("'", "\\'"), ('"', '\\"'),
+                          ('\n', '\\n'), ('\r', '\\r'), ('\0', '\\0'),
+                          ('\x1a', '\\Z')):
+        value = value.replace(char, escaped)
+    return "'{}'".format(value)
+
+
+def _format_query(statement, params):
+    """Interpolate `params` the way the db driver would, for the cli."""
+    if params is None:
+        return statement
+    if isinstance(params, dict):
+        return statement % dict((key, _sql_literal(value))
+                                for key, value in params.items())
+    return statement % tuple(_sql_literal(value) for value in params)
+
+
+def _is_read(statement):
+    words = statement.split(None, 1)
+    return bool(words) and words[0].lower() in _READ_STATEMENTS
+
 
 class MySQLClient(SSHClient):
+    """Runs queries on the nova db of the controllers.
+
+    By default queries go through the mysql cli on a controller. With
+    `db_backend = pymysql` they are sent with PyMySQL through an SSH tunnel
+    to a controller instead, falling back to the cli when PyMySQL is not
+    installed. Rows returned by the PyMySQL backend hold typed values while
+    the cli returns strings.
+
+    With the cli, read-only queries are spread across the controllers.
+    Once a client wrote, all its queries go to the controller db writes
+    stick to, so that it reads its own writes.
+    """
+
     def __init__(self):
         super(MySQLClient, self).__init__()
+        self.router = routing.get_router()
+        self._wrote = False
+        # discover db connection params by accessing nova.conf remotely.
         # the nova conf file may contain a private IP.
-        # let's just assume the db is available on the same node.
-        self.host = CONF.compute_private_config.target_controller
+        # let's just assume the db is available on the node that answered,
+        # which may differ from the one first picked if it was down.
+        self.host, connection = self.router.execute(
+            lambda host: (host, get_db_connection(host)), routing.DB_WRITES)
+        self.username = connection['username']
+        self.password = connection['password']
+        self.database = connection['database']
+
+        self.backend = None
+        if CONF.compute_private_config.db_backend == 'pymysql':
+            self.backend = _get_pymysql_backend(self.host, connection,
+                                                self.ssh_user, self.ssh_key)
 
-        # discover db connection params by accessing nova.conf remotely
-        ssh_client = SSHClient()
-        cmd = 'grep "connection=mysql+pymysql://nova:" /etc/nova/nova.conf'
-        connection = ssh_client.execute(self.host, "sudo {}".format(cmd))
-        connection_url = "=".join(connection.split("=")[1:])
-        p = urlparse.urlparse(connection_url)
+    def _sticky_key(self, statements):
+        if not self._wrote and all(_is_read(statement)
+                                   for statement in statements):
+            return None
+        self._wrote = True
+        return routing.DB_WRITES
 
-        self.username = p.username
-        self.password = p.password
-        self.database = p.path[1:]
+    def _execute_routed(self, cmd, statements):
+        return self.router.execute(lambda host: self.execute(host, cmd),
+                                   self._sticky_key(statements))
 
+    @timing.timed('mysql')
     def execute_command(self, command):
         sql_cmd = "mysql -u{} -p{} -e '{}' {}".format(
             self.username,
             self.password,
             command,
             self.database)
-        return self.execute(self.host, sql_cmd)
+        return self._execute_routed(sql_cmd, [command])
+
+    @timing.timed('mysql')
+    def execute_queries(self, statements, as_dict=True):
+        """Run several statements in a single mysql invocation.
+
+        The statements are sent in one SSH round trip and share the same
+        db session. Each statement is either a string or a (statement,
+        params) pair using the %s placeholders of the db driver. The cli
+        batch output is split back per statement with marker rows, so the
+        result is a list with, for each statement, its rows as dicts (or
+        tuples if `as_dict` is False). Statements that return no result
+        set, like UPDATE, get an empty list. With the cli, NULL values are
+        returned as None, all other values as strings.
+        """
+        queries = [(statement, None)
+                   if isinstance(statement, six.string_types) else statement
+                   for statement in statements]
+        if self.backend is not None:
+            return self.backend.execute_queries(queries, as_dict)
+
+        sql_cmd, markers = self.batch_command(queries)
+        output = self._execute_routed(
+            sql_cmd, [statement for statement, _ in queries])
+        return parse_batch_output(output, markers, as_dict)
+
+    def batch_command(self, queries):
+        """Return the mysql cli command running (statement, params) pairs.
+
+        Returns the command and the markers to split its output with
+        parse_batch_output.
+        """
+        statements = [_format_query(statement, params)
+                      for statement, params in queries]
+        token = uuid.uuid4().hex[:8]
+        markers = ['rhos_{}_{}'.format(token, index)
+                   for index in range(len(statements))]
+        script = ''.join(
+            "SELECT '{0}' AS {0}; {1};\n".format(
+                marker, statement.strip().rstrip(';'))
+            for marker, statement in zip(markers, statements))
+        sql_cmd = "mysql -u{} -p{} --batch -e {} {}".format(
+            self.username,
+            self.password,
+            shlex_quote(script),
+            self.database)
+        return sql_cmd, markers
+
+    def execute_query(self, statement, params=None, as_dict=True):
+        """Run a single statement and return its rows."""
+        return self.execute_queries([(statement, params)],
+                                    as_dict=as_dict)[0]
+
+    def iter_query(self, statement, params=None, as_dict=True):
+        """Iterate over the rows of a single statement.
+
+        Both backends yield the rows as the server sends them, so large
+        result sets are never held in memory at once.
+        """
+        if self.backend is not None:
+            return self.backend.iter_query(statement, params, as_dict)
+        sql_cmd, markers = self.batch_command([(statement, params)])
+        # No failover once rows were yielded.
+        host = self.router.pick(self._sticky_key([statement]))
+        return _iter_batch_rows(self.iter_execute(host, sql_cmd),
+                                markers[0], as_dict)
+
+
+def _unescape_batch_value(value):
+    if value == 'NULL':
+        return None
+    if '\\' not in value:
+        return value
+    chars = []
+    escaped = False
+    for char in value:
+        if escaped:
+            chars.append(_BATCH_ESCAPES.get(char, char))
+            escaped = False
+        elif char == '\\':
+            escaped = True
+        else:
+            chars.append(char)
+    return ''.join(chars)
+
+
+def _iter_batch_rows(lines, marker, as_dict=True):
+    """Yield the rows of a single statement from streamed batch output."""
+    try:
+        for line in lines:
+            if line == marker:
+                # Skip the value of the marker result set.
+                next(lines, None)
+                break
+        else:
+            raise ValueError('Missing output for 1 statement(s) in mysql '
+                             'batch output')
+        columns = None
+        for line in lines:
+            values = line.split('\t')
+            if columns is None:
+                columns = values
+                continue
+            row = tuple(_unescape_batch_value(value) for value in values)
+            yield dict(zip(columns, row)) if as_dict else row
+    finally:
+        lines.close()
+
+
+def parse_batch_output(output, markers, as_dict=True):
+    """Split `mysql --batch` output into per statement rows."""
+    results = []
+    # Values are escaped in batch mode, so rows never span several lines.
+    lines = output.split('\n')
+    if lines and lines[-1] == '':
+        lines.pop()
+    lines = iter(lines)
+    pending = list(markers)
+    current = None
+    columns = None
+    for line in lines:
+        if pending and line == pending[0]:
+            # The marker result set is its column name followed by its value.
+            next(lines, None)
+            pending.pop(0)
+            current = []
+            columns = None
+            results.append(current)
+            continue
+        if current is None:
+            continue
+        values = line.split('\t')
+        if columns is None:
+            columns = values
+            continue
+        row = tuple(_unescape_batch_value(value) for value in values)
+        current.append(dict(zip(columns, row)) if as_dict else row)
+    if pending:
+        raise ValueError('Missing output for {} statement(s) in mysql batch '
+                         'output'.format(len(pending)))
+    return results
 
 
 class NovaManageClient(SSHClient):
+    """Runs nova-manage on the controller db writes stick to."""
+
     def __init__(self):
         super(NovaManageClient, self).__init__()
-        self.hostname = CONF.compute_private_config.target_controller
+        self.router = routing.get_router()
+        self.hostname = self.router.pick(routing.DB_WRITES)
+
+    @staticmethod
+    def command(command):
+        return "sudo nova-manage {}".format(command)
 
+    @timing.timed('nova_manage')
     def execute_command(self, command):
-        nova_cmd = "sudo nova-manage {}".format(command)
-        return self.execute(self.hostname, nova_cmd)
+        nova_cmd = self.command(command)
+        return self.router.execute(
+            lambda host: self.execute(host, nova_cmd), routing.DB_WRITES)
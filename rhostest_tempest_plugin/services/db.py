@@ -0,0 +1,153 @@
+# Copyright 2016 Red Hat
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+import contextlib
+import importlib
+import threading
+
+from oslo_log import log as logging
+from six.moves import queue
+
+from rhostest_tempest_plugin.services import ssh_pool
+
+LOG = logging.getLogger(__name__)
+
+# Imported by the first backend created, most runs never need PyMySQL.
+pymysql = None
+cursors = None
+
+
+def _import_pymysql():
+    global cursors, pymysql
+    if pymysql is None:
+        cursors = importlib.import_module('pymysql.cursors')
+        pymysql = importlib.import_module('pymysql')
+
+
+class PyMySQLBackend(object):
+    """Runs queries with PyMySQL instead of the remote mysql cli.
+
+    When `tunnel_through` is given as a (host, user, key_filename) tuple,
+    the db is reached through a local port forwarded over a pooled SSH
+    connection to that host, so `db_host` only needs to be reachable from
+    it. Otherwise `db_host` is connected to directly, e.g. for a local
+    MySQL/MariaDB stand-in.
+
+    Up to `pool_size` db connections are kept open and shared between
+    threads. Parameters are passed to the driver separately from the
+    statement, never formatted in by the caller.
+    """
+
+    def __init__(self, db_host, db_port, username, password, database,
+                 pool_size=2, tunnel_through=None):
+        try:
+            _import_pymysql()
+        except ImportError:
+            raise RuntimeError('PyMySQL is not installed')
+        self.db_host = db_host
+        self.db_port = db_port or 3306
+        self.username = username
+        self.password = password
+        self.database = database
+        self.tunnel_through = tunnel_through
+        self._tunnel = None
+        self._tunnel_lock = threading.Lock()
+        self._connections = queue.LifoQueue(maxsize=pool_size)
+
+    def _endpoint(self):
+        if self.tunnel_through is None:
+            return self.db_host, self.db_port
+        with self._tunnel_lock:
+            if self._tunnel is None or not self._tunnel.is_alive():
+                if self._tunnel is not None:
+                    self._tunnel.close()
+                host, user, key_filename = self.tunnel_through
+                self._tunnel = ssh_pool.SSHTunnel(
+                    ssh_pool.get_connection_pool(), host, user,
+                    key_filename, self.db_host, self.db_port)
+            return '127.0.0.1', self._tunnel.local_port
+
+    def _connect(self):
+        host, port = self._endpoint()
+        return pymysql.connect(host=host, port=port, user=self.username,
+                               password=self.password, db=self.database,
+                               charset='utf8', autocommit=True)
+
+    @contextlib.contextmanager
+    def connection(self):
+        """Check a db connection out of the pool."""
+        try:
+            conn = self._connections.get_nowait()
+        except queue.Empty:
+            conn = self._connect()
+        reusable = True
+        try:
+            yield conn
+        except pymysql.err.OperationalError:
+            # Likely a dropped connection or tunnel, do not reuse it.
+            reusable = False
+            raise
+        finally:
+            if reusable:
+                self._release(conn)
+            else:
+                conn.close()
+
+    def _release(self, conn):
+        try:
+            self._connections.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def execute_queries(self, queries, as_dict=True):
+        """Run (statement, params) pairs in one session.
+
+        Returns the rows of each statement, in order.
+        """
+        cursor_class = cursors.DictCursor if as_dict else cursors.Cursor
+        results = []
+        with self.connection() as conn:
+            with conn.cursor(cursor_class) as cursor:
+                for statement, params in queries:
+                    cursor.execute(statement, params)
+                    results.append(list(cursor.fetchall()))
+        return results
+
+    def iter_query(self, statement, params=None, as_dict=True):
+        """Yield the rows of `statement` as the server sends them.
+
+        Uses an unbuffered cursor, so large result sets are never held in
+        memory at once. The connection is busy until the generator is
+        exhausted or closed.
+        """
+        cursor_class = cursors.SSDictCursor if as_dict else cursors.SSCursor
+        with self.connection() as conn:
+            cursor = conn.cursor(cursor_class)
+            try:
+                cursor.execute(statement, params)
+                for row in cursor:
+                    yield row
+            finally:
+                cursor.close()
+
+    def close(self):
+        while True:
+            try:
+                self._connections.get_nowait().close()
+            except queue.Empty:
+                break
+        with self._tunnel_lock:
+            if self._tunnel is not None:
+                self._tunnel.close()
+                self._tunnel = None
@@ -0,0 +1,168 @@
+# Copyright 2016 Red Hat
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""Keep-alive HTTP connections shared by the service clients.
+
+Tempest gives each service client its own ClosingHttp, which asks the API
+to close the connection after every request, so each request pays a new
+TCP connection and TLS handshake. The clients of the plugin tests are
+given instead a process wide KeepAliveHttp per set of TLS settings, whose
+connections are kept open and reused by all the clients talking to the
+same endpoint.
+"""
+import atexit
+import collections
+import threading
+
+from oslo_log import log as logging
+from tempest import config
+from tempest.lib.common import http
+import urllib3
+from urllib3 import connectionpool
+
+CONF = config.CONF
+LOG = logging.getLogger(__name__)
+
+
+class ConnectionStats(object):
+    """Counts the requests sent and the connections opened, per host."""
+
+    def __init__(self):
+        # host -> {'requests': n, 'connections': n}
+        self._counts = collections.defaultdict(collections.Counter)
+        self._lock = threading.Lock()
+
+    def count(self, host, what):
+        with self._lock:
+            self._counts[host][what] += 1
+
+    @property
+    def stats(self):
+        """Return {host: {'requests', 'connections', 'reused'}}."""
+        with self._lock:
+            return dict((host, {'requests': counts['requests'],
+                                'connections': counts['connections'],
+                                'reused': max(counts['requests'] -
+                                              counts['connections'], 0)})
+                        for host, counts in self._counts.items())
+
+
+STATS = ConnectionStats()
+
+
+class _CountingPoolMixin(object):
+
+    def _stats_host(self):
+        return '{}://{}:{}'.format(self.scheme, self.host, self.port)
+
+    def _new_conn(self):
+        STATS.count(self._stats_host(), 'connections')
+        return super(_CountingPoolMixin, self)._new_conn()
+
+    def urlopen(self, *args, **kwargs):
+        STATS.count(self._stats_host(), 'requests')
+        return super(_CountingPoolMixin, self).urlopen(*args, **kwargs)
+
+
+class _HTTPConnectionPool(_CountingPoolMixin,
+                          connectionpool.HTTPConnectionPool):
+    pass
+
+
+class _HTTPSConnectionPool(_CountingPoolMixin,
+                           connectionpool.HTTPSConnectionPool):
+    pass
+
+
+class KeepAliveHttp(http.ClosingHttp):
+    """ClosingHttp keeping its connections open between requests.
+
+    Up to `maxsize` connections per host are kept open. Requests beyond
+    that still go through, on connections closed once done.
+    """
+
+    def __init__(self, maxsize, **connection_pool_kw):
+        # ClosingHttp.__init__ only turns its arguments into the pool
+        # keywords, which are given as is here.
+        urllib3.PoolManager.__init__(self, maxsize=maxsize, block=False,
+                                     **connection_pool_kw)
+        self.pool_classes_by_scheme = {'http': _HTTPConnectionPool,
+                                       'https': _HTTPSConnectionPool}
+
+    def urlopen(self, method, url, redirect=True, **kw):
+        # ClosingHttp.request() adds "connection: close" to the headers.
+        headers = dict((key, value)
+                       for key, value in (kw.get('headers') or {}).items()
+                       if key.lower() != 'connection')
+        kw['headers'] = headers
+        return super(KeepAliveHttp, self).urlopen(method, url,
+                                                  redirect=redirect, **kw)
+
+
+# Pool keywords (TLS settings, timeout) -> KeepAliveHttp
+_POOL_MANAGERS = {}
+_POOL_MANAGERS_LOCK = threading.Lock()
+
+
+def get_http(connection_pool_kw):
+    """Return the process wide KeepAliveHttp using `connection_pool_kw`."""
+    key = tuple(sorted(connection_pool_kw.items()))
+    with _POOL_MANAGERS_LOCK:
+        if not _POOL_MANAGERS:
+            atexit.register(_log_stats)
+        if key not in _POOL_MANAGERS:
+            _POOL_MANAGERS[key] = KeepAliveHttp(
+                CONF.compute_private_config.http_pool_maxsize,
+                **connection_pool_kw)
+        return _POOL_MANAGERS[key]
+
+
+def share(client):
+    """Make `client` use the shared keep-alive connections.
+
+    Anything else than a tempest rest client is left untouched.
+    """
+    http_obj = getattr(client, 'http_obj', None)
+    if (not CONF.compute_private_config.http_keepalive or
+            not isinstance(http_obj, http.ClosingHttp) or
+            isinstance(http_obj, KeepAliveHttp)):
+        return client
+    client.http_obj = get_http(http_obj.connection_pool_kw)
+    return client
+
+
+def _is_client_manager(value):
+    return (hasattr(value, 'auth_provider') and
+            not hasattr(value, 'http_obj'))
+
+
+def share_clients(cls):
+    """Share the connections of the clients of test class `cls`.
+
+    Those are the clients set on the class and the ones its client
+    managers, e.g. `os_adm`, already created.
+    """
+    for klass in cls.__mro__:
+        for value in list(vars(klass).values()):
+            if _is_client_manager(value):
+                for client in list(vars(value).values()):
+                    share(client)
+            else:
+                share(value)
+
+
+def _log_stats():
+    for host, stats in sorted(STATS.stats.items()):
+        LOG.info('HTTP connections to %s: %d requests on %d connections',
+                 host, stats['requests'], stats['connections'])
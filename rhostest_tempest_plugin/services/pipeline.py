@@ -0,0 +1,181 @@
+# Copyright 2016 Red Hat
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+import base64
+import collections
+import uuid
+
+import six
+from six.moves import shlex_quote
+from tempest.lib import exceptions
+
+from rhostest_tempest_plugin.lib import timing
+from rhostest_tempest_plugin.services import clients
+from rhostest_tempest_plugin.services import routing
+
+
+# Outcome of a pipeline step. exit_status, stdout, stderr and duration are
+# None for the steps skipped after a failure. output holds the rows of each
+# statement for sql steps, as returned by MySQLClient.execute_queries, and
+# stdout for the other steps.
+StepResult = collections.namedtuple('StepResult', [
+    'kind', 'command', 'exit_status', 'stdout', 'stderr', 'duration',
+    'output'])
+
+_Step = collections.namedtuple('_Step', ['kind', 'command', 'markers',
+                                         'as_dict'])
+
+
+class RemotePipeline(clients.SSHClient):
+    """Runs a sequence of sql, nova-manage and shell steps in one go.
+
+    The steps are queued, then shipped to the node as a single script run
+    on one SSH channel. They run in order, by default stopping at the
+    first failing one, and run() returns the exit status, output and
+    duration of each of them.
+
+    SQL steps always use the mysql cli on the node, whatever the
+    `db_backend`.
+
+        pipeline = RemotePipeline()
+        pipeline.sql([(select, (server_id,)), update])
+        pipeline.nova_manage('project quota_usage_refresh --project ...')
+        pipeline.sql([(select, (server_id,))])
+        rows, refresh, synced = pipeline.run()
+    """
+
+    def __init__(self, hostname=None, mysql_client=None):
+        super(RemotePipeline, self).__init__()
+        # None: the controller db writes stick to, see routing.
+        self.hostname = hostname
+        self._mysql_client = mysql_client
+        self.steps = []
+
+    @property
+    def mysql_client(self):
+        if self._mysql_client is None:
+            self._mysql_client = clients.MySQLClient()
+        return self._mysql_client
+
+    def sql(self, statements, as_dict=True):
+        """Queue statements run in a single db session.
+
+        Statements are strings or (statement, params) pairs, as for
+        MySQLClient.execute_queries.
+        """
+        queries = [(statement, None)
+                   if isinstance(statement, six.string_types) else statement
+                   for statement in statements]
+        command, markers = self.mysql_client.batch_command(queries)
+        self.steps.append(_Step('sql', command, markers, as_dict))
+        return self
+
+    def nova_manage(self, command):
+        self.steps.append(_Step('nova_manage',
+                                clients.NovaManageClient.command(command),
+                                None, None))
+        return self
+
+    def shell(self, command):
+        self.steps.append(_Step('shell', command, None, None))
+        return self
+
+    @staticmethod
+    def _script(steps, token, stop_on_error):
+        """Return the bash script running `steps`.
+
+        After each step, the script prints a `token index exit_status start
+        end` line followed by the step stdout and stderr, base64 encoded on
+        one line each.
+        """
+        lines = ['d=$(mktemp -d)',
+                 'trap \'rm -rf "$d"\' EXIT']
+        for index, step in enumerate(steps):
+            lines.extend([
+                's=$(date +%s.%N)',
+                '( {} ) </dev/null >"$d/out" 2>"$d/err"'.format(
+                    step.command),
+                'rc=$?',
+                'e=$(date +%s.%N)',
+                'echo "{} {} $rc $s $e"'.format(token, index),
+                'base64 -w0 "$d/out"; echo',
+                'base64 -w0 "$d/err"; echo'])
+            if stop_on_error:
+                lines.append('[ $rc -eq 0 ] || exit 0')
+        lines.append('exit 0')
+        return '\n'.join(lines) + '\n'
+
+    @timing.timed('pipeline')
+    def run(self, stop_on_error=True, check=True):
+        """Run the queued steps and return a StepResult per step.
+
+        With `check`, SSHExecCommandFailed is raised for the first step
+        which failed. The queue is emptied either way.
+        """
+        steps, self.steps = self.steps, []
+        if not steps:
+            return []
+        token = 'rhos_step_{}'.format(uuid.uuid4().hex[:8])
+        script = self._script(steps, token, stop_on_error)
+        cmd = 'bash -c {}'.format(shlex_quote(script))
+        if self.hostname:
+            output = self.execute(self.hostname, cmd)
+        else:
+            output = routing.get_router().execute(
+                lambda host: self.execute(host, cmd), routing.DB_WRITES)
+        results = self._parse_output(steps, token, output)
+        for result in results:
+            if result.duration is not None:
+                timing.RECORDER.record('pipeline.' + result.kind,
+                                       result.duration)
+        if check:
+            for result in results:
+                if result.exit_status:
+                    raise exceptions.SSHExecCommandFailed(
+                        command=result.command,
+                        exit_status=result.exit_status,
+                        stderr=result.stderr, stdout=result.stdout)
+        return results
+
+    @staticmethod
+    def _decode(line):
+        return base64.b64decode(line).decode('utf-8')
+
+    def _parse_output(self, steps, token, output):
+        reports = {}
+        lines = iter(output.split('\n'))
+        for line in lines:
+            fields = line.split()
+            if len(fields) != 5 or fields[0] != token:
+                continue
+            stdout = self._decode(next(lines))
+            stderr = self._decode(next(lines))
+            reports[int(fields[1])] = (int(fields[2]), stdout, stderr,
+                                       float(fields[4]) - float(fields[3]))
+        results = []
+        for index, step in enumerate(steps):
+            if index not in reports:
+                results.append(StepResult(step.kind, step.command, None,
+                                          None, None, None, None))
+                continue
+            exit_status, stdout, stderr, duration = reports[index]
+            step_output = stdout
+            if step.kind == 'sql':
+                step_output = None
+                if exit_status == 0:
+                    step_output = clients.parse_batch_output(
+                        stdout, step.markers, step.as_dict)
+            results.append(StepResult(step.kind, step.command, exit_status,
+                                      stdout, stderr, duration, step_output))
+        return results
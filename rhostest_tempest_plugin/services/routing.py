@@ -0,0 +1,189 @@
+# Copyright 2016 Red Hat
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+import collections
+import itertools
+import threading
+import time
+
+from oslo_log import log as logging
+from tempest import config
+from tempest.lib import exceptions
+
+from rhostest_tempest_plugin.lib import concurrency
+from rhostest_tempest_plugin.services import ssh_pool
+
+CONF = config.CONF
+LOG = logging.getLogger(__name__)
+
+# Sticky key of the commands touching the nova db: they all go to the same
+# controller, so a test reads its own writes and writes never conflict
+# between galera nodes.
+DB_WRITES = 'db'
+
+
+def failover_errors():
+    """Errors meaning a controller is unreachable.
+
+    Only ssh_pool.CommandNotStarted guarantees that the command did not
+    run.
+    """
+    return (ssh_pool.CommandNotStarted, exceptions.SSHTimeout) + (
+        ssh_pool.connection_errors())
+
+
+class NoHealthyController(exceptions.TempestException):
+    message = "None of the controllers %(controllers)s is reachable"
+
+
+class ControllerRouter(object):
+    """Spreads the commands run on the controllers across them.
+
+    Commands go to the healthy controller with the fewest commands in
+    flight, ties broken round-robin. Commands given a sticky key all go to
+    the same controller, as long as it is healthy. A controller which
+    cannot be reached is marked down and the command is retried on
+    another one; it is tried again `retry_interval` seconds later.
+    """
+
+    def __init__(self, controllers, retry_interval=30):
+        self.controllers = list(controllers)
+        self.retry_interval = retry_interval
+        # controller -> time it was marked down
+        self._down = {}
+        self._in_flight = collections.Counter()
+        self._sticky = {}
+        self._turn = itertools.count()
+        self._lock = threading.Lock()
+
+    def _healthy(self):
+        now = time.time()
+        return [controller for controller in self.controllers
+                if now - self._down.get(controller, 0) >= self.retry_interval]
+
+    def healthy(self):
+        with self._lock:
+            return self._healthy()
+
+    def mark_down(self, controller):
+        LOG.warning('Controller %s is unreachable, failing over', controller)
+        with self._lock:
+            self._down[controller] = time.time()
+            for key, sticky in list(self._sticky.items()):
+                if sticky == controller:
+                    del self._sticky[key]
+
+    def mark_up(self, controller):
+        with self._lock:
+            self._down.pop(controller, None)
+
+    def pick(self, sticky_key=None, exclude=()):
+        """Return the controller the next command should run on.
+
+        When all the controllers not in `exclude` are down, they are
+        picked from anyway rather than failing right away.
+        """
+        with self._lock:
+            healthy = [controller for controller in self._healthy()
+                       if controller not in exclude]
+            if not healthy:
+                healthy = [controller for controller in self.controllers
+                           if controller not in exclude]
+            if not healthy:
+                raise NoHealthyController(controllers=self.controllers)
+            if sticky_key is not None:
+                if self._sticky.get(sticky_key) not in healthy:
+                    # The first healthy one, so that all the workers of a
+                    # run agree on it.
+                    self._sticky[sticky_key] = healthy[0]
+                return self._sticky[sticky_key]
+            turn = next(self._turn)
+            return min(healthy, key=lambda controller: (
+                self._in_flight[controller],
+                (healthy.index(controller) - turn) % len(healthy)))
+
+    def check(self, probe):
+        """Probe all the controllers concurrently and update their health.
+
+        `probe` is called with each controller and raises if it is not
+        usable.
+        """
+        for outcome in concurrency.run_concurrently(probe, self.controllers,
+                                                    len(self.controllers)):
+            if outcome.error is None:
+                self.mark_up(outcome.item)
+            else:
+                self.mark_down(outcome.item)
+        return self.healthy()
+
+    def execute(self, func, sticky_key=None):
+        """Call `func` with a controller, failing over to the others.
+
+        `func` runs the command on the controller it is given. It is
+        retried on another controller if the one picked is unreachable,
+        until all of them were tried. Commands given a sticky key may
+        write, they are only retried if they did not start; the others
+        must only read, and are retried whenever the connection broke.
+        """
+        tried = []
+        while True:
+            controller = self.pick(sticky_key, exclude=tried)
+            with self._lock:
+                self._in_flight[controller] += 1
+            try:
+                return func(controller)
+            except failover_errors() as exc:
+                self.mark_down(controller)
+                tried.append(controller)
+                started = not isinstance(exc, ssh_pool.CommandNotStarted)
+                if ((started and sticky_key is not None) or
+                        len(tried) == len(self.controllers)):
+                    raise
+            finally:
+                with self._lock:
+                    self._in_flight[controller] -= 1
+
+
+_ROUTER = None
+_ROUTER_LOCK = threading.Lock()
+
+
+def get_controllers():
+    """Return the controllers of the deployment."""
+    opts = CONF.compute_private_config
+    return list(opts.target_controllers) or [opts.target_controller]
+
+
+def ssh_probe(controller):
+    """Run `true` on `controller` over SSH."""
+    opts = CONF.compute_private_config
+    ssh_pool.get_connection_pool().execute(
+        controller, opts.target_ssh_user, opts.target_private_key_path,
+        'true', timeout=10, connect_timeout=10)
+
+
+def get_router():
+    """Return the process wide controller router.
+
+    With several controllers, they are all probed when it is created.
+    """
+    global _ROUTER
+    with _ROUTER_LOCK:
+        if _ROUTER is None:
+            _ROUTER = ControllerRouter(
+                get_controllers(),
+                CONF.compute_private_config.controller_retry_interval)
+            if len(_ROUTER.controllers) > 1:
+                _ROUTER.check(ssh_probe)
+        return _ROUTER
@@ -0,0 +1,484 @@
+# Copyright 2016 Red Hat
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+import atexit
+import codecs
+import collections
+import contextlib
+import importlib
+import select
+import socket
+import threading
+import time
+
+from oslo_log import log as logging
+from tempest import config
+from tempest.lib import exceptions
+
+from rhostest_tempest_plugin.lib import timing
+
+
+CONF = config.CONF
+LOG = logging.getLogger(__name__)
+
+# Stderr kept from a streamed command, for the error raised if it fails.
+MAX_STDERR_BYTES = 64 * 1024
+
+# paramiko and the tempest ssh client are only imported once a connection
+# is needed, loading the test modules does not pay for them.
+paramiko = None
+ssh = None
+
+
+def _import_ssh():
+    global paramiko, ssh
+    if ssh is None:
+        paramiko = importlib.import_module('paramiko')
+        ssh = importlib.import_module('tempest.lib.common.ssh')
+
+
+def connection_errors():
+    """Errors meaning the transport is unusable.
+
+    The command has to be retried on a fresh connection.
+    """
+    _import_ssh()
+    return EOFError, socket.error, paramiko.SSHException
+
+
+class CommandNotStarted(exceptions.TempestException):
+    """The command was not sent to the host, it can safely be retried."""
+    message = "Command not started on '%(host)s': %(reason)s"
+
+
+class ConnectFailed(CommandNotStarted):
+    message = "Connecting to '%(host)s' failed: %(reason)s"
+
+
+class ChannelOpenFailed(CommandNotStarted):
+    message = "Opening a channel to '%(host)s' failed: %(reason)s"
+
+
+class OutputLimitExceeded(exceptions.TempestException):
+    message = ("Output of command '%(cmd)s' on host '%(host)s' exceeded "
+               "%(max_bytes)d bytes")
+
+
+class PooledConnection(object):
+    """A persistent SSH connection owned by a SSHConnectionPool."""
+
+    def __init__(self, key, client, connection):
+        self.key = key
+        self.client = client
+        self.connection = connection
+        self.created_at = self.last_used = time.time()
+
+    def is_alive(self):
+        transport = self.connection.get_transport()
+        return transport is not None and transport.is_active()
+
+    def _open_channel(self, cmd):
+        transport = self.connection.get_transport()
+        if transport is None:
+            raise ChannelOpenFailed(host=self.key[0],
+                                    reason='not connected')
+        try:
+            channel = transport.open_session()
+        except connection_errors() as exc:
+            raise ChannelOpenFailed(host=self.key[0], reason=exc)
+        channel.fileno()  # Register event pipe
+        # From here on, the command may have run even if an error is
+        # raised.
+        channel.exec_command(cmd)
+        channel.shutdown_write()
+        return channel
+
+    def _read_channel(self, channel, cmd, timeout):
+        """Yield (stdout chunk, stderr chunk) pairs as they are received.
+
+        Either chunk may be None. Stops once the channel is closed.
+        """
+        poll = select.poll()
+        poll.register(channel, select.POLLIN)
+        start_time = time.time()
+        while True:
+            ready = poll.poll(self.client.channel_timeout)
+            if not any(ready):
+                if time.time() - start_time <= timeout:
+                    continue
+                raise exceptions.TimeoutException(
+                    "Command: '{0}' executed on host '{1}'.".format(
+                        cmd, self.client.host))
+            if not ready[0]:
+                continue
+            out_chunk = err_chunk = None
+            if channel.recv_ready():
+                out_chunk = channel.recv(self.client.buf_size)
+            if channel.recv_stderr_ready():
+                err_chunk = channel.recv_stderr(self.client.buf_size)
+            if out_chunk or err_chunk:
+                yield out_chunk, err_chunk
+            elif channel.closed:
+                return
+
+    def exec_command(self, cmd, encoding="utf-8", timeout=None):
+        """Run `cmd` on a new channel of the persistent transport.
+
+        Mirrors tempest.lib.common.ssh.Client.exec_command, minus the
+        connection setup. `timeout` defaults to the one of the tempest
+        client.
+        """
+        if timeout is None:
+            timeout = self.client.timeout
+        channel = self._open_channel(cmd)
+        try:
+            out_data_chunks = []
+            err_data_chunks = []
+            for out_chunk, err_chunk in self._read_channel(channel, cmd,
+                                                           timeout):
+                if out_chunk:
+                    out_data_chunks.append(out_chunk)
+                if err_chunk:
+                    err_data_chunks.append(err_chunk)
+            exit_status = channel.recv_exit_status()
+        finally:
+            channel.close()
+        self.last_used = time.time()
+
+        out_data = b''.join(out_data_chunks)
+        err_data = b''.join(err_data_chunks)
+        if encoding:
+            out_data = out_data.decode(encoding)
+            err_data = err_data.decode(encoding)
+        if 0 != exit_status:
+            raise exceptions.SSHExecCommandFailed(
+                command=cmd, exit_status=exit_status,
+                stderr=err_data, stdout=out_data)
+        return out_data
+
+    def iter_command(self, cmd, encoding="utf-8", timeout=None,
+                     max_bytes=None, lines=True):
+        """Yield the output of `cmd` as it is received.
+
+        Yields lines, without their line feed, or decoded chunks if `lines`
+        is False. Closing the generator early closes the channel, which
+        stops the remote command. OutputLimitExceeded is raised once more
+        than `max_bytes` bytes of stdout are received, and
+        SSHExecCommandFailed once the whole output was yielded if the
+        command failed.
+        """
+        if timeout is None:
+            timeout = self.client.timeout
+        decoder = codecs.getincrementaldecoder(encoding)('replace')
+        channel = self._open_channel(cmd)
+        try:
+            received = err_received = 0
+            err_data_chunks = []
+            pending = ''
+            for out_chunk, err_chunk in self._read_channel(channel, cmd,
+                                                           timeout):
+                if err_chunk and err_received < MAX_STDERR_BYTES:
+                    err_data_chunks.append(err_chunk)
+                    err_received += len(err_chunk)
+                if not out_chunk:
+                    continue
+                received += len(out_chunk)
+                if max_bytes and received > max_bytes:
+                    raise OutputLimitExceeded(cmd=cmd, host=self.key[0],
+                                              max_bytes=max_bytes)
+                text = decoder.decode(out_chunk)
+                if not lines:
+                    if text:
+                        yield text
+                    continue
+                received_lines = (pending + text).split('\n')
+                pending = received_lines.pop()
+                for line in received_lines:
+                    yield line
+            pending += decoder.decode(b'', final=True)
+            if pending:
+                yield pending
+            exit_status = channel.recv_exit_status()
+        finally:
+            channel.close()
+            self.last_used = time.time()
+        if 0 != exit_status:
+            raise exceptions.SSHExecCommandFailed(
+                command=cmd, exit_status=exit_status,
+                stderr=b''.join(err_data_chunks).decode(encoding, 'replace'),
+                stdout='<streamed>')
+
+    def close(self):
+        try:
+            self.connection.close()
+        except Exception:
+            LOG.debug('Error closing SSH connection to %s', self.key[0],
+                      exc_info=True)
+
+
+class SSHConnectionPool(object):
+    """Keeps SSH connections open across commands.
+
+    Connections are keyed by (host, user, key_filename). A connection is
+    checked out for the duration of a single command, so concurrent callers
+    targeting the same host each get their own connection. At most
+    `max_size` idle connections are kept per key, and idle connections
+    older than `idle_timeout` seconds are closed. A command which could not
+    start because the transport broke is retried once on a fresh
+    connection. Errors raised once it started are not, as the command may
+    already have run.
+    """
+
+    def __init__(self, max_size=4, idle_timeout=300, keepalive_interval=30,
+                 connect=None):
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.keepalive_interval = keepalive_interval
+        self._connect = connect or self._ssh_connect
+        self._idle = collections.defaultdict(list)
+        self._lock = threading.Lock()
+        self._stats = collections.Counter()
+
+    @property
+    def stats(self):
+        """Snapshot of the hits/misses/evictions/reconnects counters."""
+        with self._lock:
+            return dict(self._stats)
+
+    @timing.timed('ssh.connect')
+    def _ssh_connect(self, key, timeout=None):
+        host, user, key_filename = key
+        _import_ssh()
+        client = ssh.Client(host, user, key_filename=key_filename)
+        default_timeout = client.timeout
+        if timeout is not None:
+            # Bounds the connection attempts only, the commands later run
+            # on the pooled connection keep the default timeout.
+            client.timeout = timeout
+        try:
+            connection = client._get_ssh_connection()
+        finally:
+            client.timeout = default_timeout
+        if self.keepalive_interval:
+            connection.get_transport().set_keepalive(self.keepalive_interval)
+        return PooledConnection(key, client, connection)
+
+    def _evict_idle(self):
+        # Must be called with self._lock held.
+        deadline = time.time() - self.idle_timeout
+        for key, idle in list(self._idle.items()):
+            expired = [conn for conn in idle if conn.last_used < deadline]
+            for conn in expired:
+                idle.remove(conn)
+                conn.close()
+                self._stats['evictions'] += 1
+            if not idle:
+                del self._idle[key]
+
+    def acquire(self, host, user, key_filename, connect_timeout=None):
+        """Return an idle connection, or a new one.
+
+        `connect_timeout` bounds the time spent connecting, the one of the
+        tempest ssh client by default.
+        """
+        key = (host, user, key_filename)
+        with self._lock:
+            self._evict_idle()
+            idle = self._idle.get(key, [])
+            while idle:
+                conn = idle.pop()
+                if conn.is_alive():
+                    self._stats['hits'] += 1
+                    return conn
+                conn.close()
+                self._stats['evictions'] += 1
+            self._stats['misses'] += 1
+        try:
+            return self._connect(key, connect_timeout)
+        except connection_errors() + (exceptions.SSHTimeout,) as exc:
+            raise ConnectFailed(host=host, reason=exc)
+
+    def release(self, conn, discard=False):
+        with self._lock:
+            idle = self._idle[conn.key]
+            if discard or not conn.is_alive() or len(idle) >= self.max_size:
+                conn.close()
+                return
+            idle.append(conn)
+
+    @contextlib.contextmanager
+    def connection(self, host, user, key_filename, connect_timeout=None):
+        conn = self.acquire(host, user, key_filename, connect_timeout)
+        try:
+            yield conn
+        except (exceptions.SSHExecCommandFailed,
+                exceptions.TimeoutException):
+            # The command failed, the transport is still usable.
+            self.release(conn)
+            raise
+        except Exception:
+            self.release(conn, discard=True)
+            raise
+        else:
+            self.release(conn)
+
+    def execute(self, host, user, key_filename, cmd, timeout=None,
+                connect_timeout=None):
+        try:
+            with self.connection(host, user, key_filename,
+                                 connect_timeout) as conn:
+                return conn.exec_command(cmd, timeout=timeout)
+        except ChannelOpenFailed as exc:
+            # Only retried when the command did not start, so that it never
+            # runs twice.
+            LOG.info('SSH connection to %s broken (%s), reconnecting',
+                     host, exc)
+            with self._lock:
+                self._stats['reconnects'] += 1
+            with self.connection(host, user, key_filename,
+                                 connect_timeout) as conn:
+                return conn.exec_command(cmd, timeout=timeout)
+
+    def stream(self, host, user, key_filename, cmd, timeout=None,
+               max_bytes=None, lines=True):
+        """Yield the output of `cmd` as it is received.
+
+        See PooledConnection.iter_command. The connection is checked out
+        until the generator is exhausted or closed.
+        """
+        conn = self.acquire(host, user, key_filename)
+        discard = False
+        try:
+            for item in conn.iter_command(cmd, timeout=timeout,
+                                          max_bytes=max_bytes, lines=lines):
+                yield item
+        except (exceptions.SSHExecCommandFailed,
+                exceptions.TimeoutException,
+                OutputLimitExceeded):
+            raise
+        except Exception:
+            discard = True
+            raise
+        finally:
+            self.release(conn, discard=discard)
+
+    def close_all(self):
+        with self._lock:
+            for idle in self._idle.values():
+                for conn in idle:
+                    conn.close()
+            self._idle.clear()
+
+
+class SSHTunnel(object):
+    """Forwards a local port to `remote_host:remote_port` through SSH.
+
+    The forwarding runs over a connection checked out of `pool` for the
+    lifetime of the tunnel. Each accepted local connection is relayed on
+    its own direct-tcpip channel by a daemon thread.
+    """
+
+    buf_size = 32768
+
+    def __init__(self, pool, host, user, key_filename, remote_host,
+                 remote_port):
+        self.remote_host = remote_host
+        self.remote_port = remote_port
+        self._pool = pool
+        self._conn = pool.acquire(host, user, key_filename)
+        self._server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._server.bind(('127.0.0.1', 0))
+        self._server.listen(16)
+        self.local_port = self._server.getsockname()[1]
+        self._closed = False
+        accept_thread = threading.Thread(target=self._accept_loop)
+        accept_thread.daemon = True
+        accept_thread.start()
+
+    def is_alive(self):
+        return not self._closed and self._conn.is_alive()
+
+    def _accept_loop(self):
+        while not self._closed:
+            try:
+                sock, peer = self._server.accept()
+            except socket.error:
+                break
+            try:
+                transport = self._conn.connection.get_transport()
+                channel = transport.open_channel(
+                    'direct-tcpip', (self.remote_host, self.remote_port),
+                    peer)
+            except connection_errors():
+                LOG.exception('Unable to forward to %s:%s through %s',
+                              self.remote_host, self.remote_port,
+                              self._conn.key[0])
+                sock.close()
+                continue
+            relay_thread = threading.Thread(target=self._relay,
+                                            args=(sock, channel))
+            relay_thread.daemon = True
+            relay_thread.start()
+
+    def _relay(self, sock, channel):
+        try:
+            while True:
+                ready, _, _ = select.select([sock, channel], [], [])
+                if sock in ready:
+                    data = sock.recv(self.buf_size)
+                    if not data:
+                        break
+                    channel.sendall(data)
+                if channel in ready:
+                    data = channel.recv(self.buf_size)
+                    if not data:
+                        break
+                    sock.sendall(data)
+        except connection_errors():
+            pass
+        finally:
+            channel.close()
+            sock.close()
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._server.close()
+        self._pool.release(self._conn)
+
+
+_POOL = None
+_POOL_LOCK = threading.Lock()
+
+
+def get_connection_pool():
+    """Return the process wide SSH connection pool."""
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL is None:
+            opts = CONF.compute_private_config
+            _POOL = SSHConnectionPool(
+                max_size=opts.ssh_pool_size,
+                idle_timeout=opts.ssh_pool_idle_timeout,
+                keepalive_interval=opts.ssh_keepalive_interval)
+            atexit.register(_close_pool)
+        return _POOL
+
+
+def _close_pool():
+    if _POOL is not None:
+        LOG.debug('SSH connection pool stats: %s', _POOL.stats)
+        _POOL.close_all()
@@ -17,20 +17,87 @@ from oslo_log import log as logging
 from tempest import config
 from tempest import test
 
-from tempest.common import compute
-from tempest.common import waiters
-
 from tempest.lib.common.utils import test_utils
 
+from rhostest_tempest_plugin.lib import concurrency
+from rhostest_tempest_plugin.lib import profiling
+from rhostest_tempest_plugin.lib import timing
+from rhostest_tempest_plugin.lib import waiters as rhos_waiters
+from rhostest_tempest_plugin.services import http_pool
+
 CONF = config.CONF
 LOG = logging.getLogger(__name__)
 
-
-class BaseRHOSTest(test.BaseTestCase):
+# Test class attribute -> attribute of the client manager.
+CLIENTS = {
+    'agents_client': 'agents_client',
+    'aggregates_client': 'aggregates_client',
+    'availability_zone_client': 'availability_zone_client',
+    'certificates_client': 'certificates_client',
+    'compute_images_client': 'compute_images_client',
+    'compute_networks_client': 'compute_networks_client',
+    'extensions_client': 'extensions_client',
+    'fixed_ips_client': 'fixed_ips_client',
+    'flavors_client': 'flavors_client',
+    'floating_ip_pools_client': 'floating_ip_pools_client',
+    'floating_ips_client': 'compute_floating_ips_client',
+    'hypervisor_client': 'hypervisor_client',
+    'instance_usages_audit_log_client': 'instance_usages_audit_log_client',
+    'interfaces_client': 'interfaces_client',
+    'keypairs_client': 'keypairs_client',
+    'limits_client': 'limits_client',
+    'migrations_client': 'migrations_client',
+    'quota_classes_client': 'quota_classes_client',
+    'quotas_client': 'quotas_client',
+    'security_group_default_rules_client':
+        'security_group_default_rules_client',
+    'security_group_rules_client': 'compute_security_group_rules_client',
+    'security_groups_client': 'compute_security_groups_client',
+    'server_groups_client': 'server_groups_client',
+    'servers_client': 'servers_client',
+    'services_client': 'services_client',
+    'snapshots_extensions_client': 'snapshots_extensions_client',
+    'versions_client': 'compute_versions_client',
+    'volumes_extensions_client': 'volumes_extensions_client',
+}
+
+
+class _LazyClient(object):
+    """Class attribute resolving a service client on first access.
+
+    The client is taken from the `os` client manager of the class it is
+    accessed through and cached per class, in the `_clients` dict of that
+    class: a subclass with other credentials never gets the client of its
+    parent. Assigning the attribute, on a subclass or an instance,
+    overrides it as before.
+    """
+
+    def __init__(self, name, manager_attr):
+        self.name = name
+        self.manager_attr = manager_attr
+
+    def __get__(self, instance, owner):
+        clients = vars(owner).get('_clients')
+        if clients is None:
+            clients = {}
+            setattr(owner, '_clients', clients)
+        client = clients.get(self.name)
+        if client is None:
+            client = http_pool.share(getattr(owner.os, self.manager_attr))
+            clients[self.name] = client
+        return client
+
+
+class BaseRHOSTest(profiling.ProfilingMixin, timing.TimingMixin,
+                   test.BaseTestCase):
     """Base test case class for RHOS compute tests."""
 
     credentials = ['primary']
 
+    # Resources the class sets up per worker, or must not use concurrently
+    # with other classes, see lib/scheduling.py.
+    shared_fixtures = ()
+
     @classmethod
     def skip_checks(cls):
         pass
@@ -38,40 +105,19 @@ class BaseRHOSTest(test.BaseTestCase):
     @classmethod
     def setup_clients(cls):
         super(BaseRHOSTest, cls).setup_clients()
-        cls.servers_client = cls.os.servers_client
-        cls.server_groups_client = cls.os.server_groups_client
-        cls.flavors_client = cls.os.flavors_client
-        cls.compute_images_client = cls.os.compute_images_client
-        cls.extensions_client = cls.os.extensions_client
-        cls.floating_ip_pools_client = cls.os.floating_ip_pools_client
-        cls.floating_ips_client = cls.os.compute_floating_ips_client
-        cls.keypairs_client = cls.os.keypairs_client
-        cls.security_group_rules_client = (
-            cls.os.compute_security_group_rules_client)
-        cls.security_groups_client = cls.os.compute_security_groups_client
-        cls.quotas_client = cls.os.quotas_client
-        cls.quota_classes_client = cls.os.quota_classes_client
-        cls.compute_networks_client = cls.os.compute_networks_client
-        cls.limits_client = cls.os.limits_client
-        cls.volumes_extensions_client = cls.os.volumes_extensions_client
-        cls.snapshots_extensions_client = cls.os.snapshots_extensions_client
-        cls.interfaces_client = cls.os.interfaces_client
-        cls.fixed_ips_client = cls.os.fixed_ips_client
-        cls.availability_zone_client = cls.os.availability_zone_client
-        cls.agents_client = cls.os.agents_client
-        cls.aggregates_client = cls.os.aggregates_client
-        cls.services_client = cls.os.services_client
-        cls.instance_usages_audit_log_client = (
-            cls.os.instance_usages_audit_log_client)
-        cls.hypervisor_client = cls.os.hypervisor_client
-        cls.certificates_client = cls.os.certificates_client
-        cls.migrations_client = cls.os.migrations_client
-        cls.security_group_default_rules_client = (
-            cls.os.security_group_default_rules_client)
-        cls.versions_client = cls.os.compute_versions_client
+        # The clients are resolved from cls.os on first use, see
+        # _LazyClient.
+        cls._clients = {}
+
+    @classmethod
+    def used_clients(cls):
+        """Return the names of the clients this class resolved."""
+        return sorted(vars(cls).get('_clients', ()))
 
     @classmethod
     def resource_setup(cls):
+        # The clients set by setup_clients() of the subclasses.
+        http_pool.share_clients(cls)
         super(BaseRHOSTest, cls).resource_setup()
         cls.build_interval = CONF.compute.build_interval
         cls.build_timeout = CONF.compute.build_timeout
@@ -94,66 +140,78 @@ class BaseRHOSTest(test.BaseTestCase):
 
     @classmethod
     def resource_cleanup(cls):
-        cls.clear_images()
-        cls.clear_servers()
-        cls.clear_security_groups()
-        cls.clear_server_groups()
+        # Servers have to be gone before the security groups and server
+        # groups they use can be deleted.
+        with timing.RECORDER.scope(cls.__name__ + '.resource_cleanup'):
+            cls._run_cleanup_phase(cls.clear_images, cls.clear_servers)
+            cls._run_cleanup_phase(cls.clear_security_groups,
+                                   cls.clear_server_groups)
+        LOG.debug('%s used the clients: %s', cls.__name__,
+                  ', '.join(cls.used_clients()))
         super(BaseRHOSTest, cls).resource_cleanup()
 
+    @staticmethod
+    def _run_cleanup_phase(*clear_methods):
+        outcomes = concurrency.run_concurrently(lambda clear: clear(),
+                                                clear_methods)
+        for outcome in outcomes:
+            if outcome.error is not None:
+                LOG.error('%s failed', outcome.item.__name__,
+                          exc_info=outcome.exc_info)
+
+    @staticmethod
+    def _delete_resources(delete_func, resource_ids, error_message):
+        """Delete resources concurrently, logging and ignoring failures."""
+        def delete(resource_id):
+            try:
+                test_utils.call_and_ignore_notfound_exc(delete_func,
+                                                        resource_id)
+            except Exception:
+                LOG.exception(error_message, resource_id)
+
+        concurrency.run_concurrently(
+            delete, resource_ids, CONF.compute_private_config.cleanup_workers)
+
     @classmethod
+    @timing.timed('cleanup.servers')
     def clear_servers(cls):
         LOG.debug('Clearing servers: %s', ','.join(
             server['id'] for server in cls.servers))
-        for server in cls.servers:
-            try:
-                test_utils.call_and_ignore_notfound_exc(
-                    cls.servers_client.delete_server, server['id'])
-            except Exception:
-                LOG.exception('Deleting server %s failed' % server['id'])
-
-        for server in cls.servers:
-            try:
-                waiters.wait_for_server_termination(cls.servers_client,
-                                                    server['id'])
-            except Exception:
-                LOG.exception('Waiting for deletion of server %s failed'
-                              % server['id'])
+        server_ids = [server['id'] for server in cls.servers]
+        cls._delete_resources(cls.servers_client.delete_server, server_ids,
+                              'Deleting server %s failed')
+        try:
+            rhos_waiters.wait_for_servers_termination(cls.servers_client,
+                                                      server_ids)
+        except Exception:
+            LOG.exception('Waiting for deletion of servers %s failed',
+                          ','.join(server_ids))
 
     @classmethod
+    @timing.timed('cleanup.images')
     def clear_images(cls):
         LOG.debug('Clearing images: %s', ','.join(cls.images))
-        for image_id in cls.images:
-            try:
-                test_utils.call_and_ignore_notfound_exc(
-                    cls.compute_images_client.delete_image, image_id)
-            except Exception:
-                LOG.exception('Exception raised deleting image %s' % image_id)
+        cls._delete_resources(cls.compute_images_client.delete_image,
+                              cls.images,
+                              'Exception raised deleting image %s')
 
     @classmethod
+    @timing.timed('cleanup.security_groups')
     def clear_security_groups(cls):
         LOG.debug('Clearing security groups: %s', ','.join(
             str(sg['id']) for sg in cls.security_groups))
-        for sg in cls.security_groups:
-            try:
-                test_utils.call_and_ignore_notfound_exc(
-                    cls.security_groups_client.delete_security_group, sg['id'])
-            except Exception as exc:
-                LOG.info('Exception raised deleting security group %s',
-                         sg['id'])
-                LOG.exception(exc)
+        cls._delete_resources(
+            cls.security_groups_client.delete_security_group,
+            [sg['id'] for sg in cls.security_groups],
+            'Exception raised deleting security group %s')
 
     @classmethod
+    @timing.timed('cleanup.server_groups')
     def clear_server_groups(cls):
         LOG.debug('Clearing server groups: %s', ','.join(cls.server_groups))
-        for server_group_id in cls.server_groups:
-            try:
-                test_utils.call_and_ignore_notfound_exc(
-                    cls.server_groups_client.delete_server_group,
-                    server_group_id
-                )
-            except Exception:
-                LOG.exception('Exception raised deleting server-group %s',
-                              server_group_id)
+        cls._delete_resources(cls.server_groups_client.delete_server_group,
+                              cls.server_groups,
+                              'Exception raised deleting server-group %s')
 
     @classmethod
     def create_test_server(cls, validatable=False, volume_backed=False,
@@ -167,6 +225,10 @@ class BaseRHOSTest(test.BaseTestCase):
         :param validatable: Whether the server will be pingable or sshable.
         :param volume_backed: Whether the instance is volume backed or not.
         """
+        # Pulls in the validation and remote clients, only load it when
+        # servers are created.
+        from tempest.common import compute
+
         tenant_network = cls.get_tenant_network()
         body, servers = compute.create_test_server(
             cls.os,
@@ -179,3 +241,7 @@ class BaseRHOSTest(test.BaseTestCase):
         cls.servers.extend(servers)
 
         return body
+
+
+for _name, _manager_attr in CLIENTS.items():
+    setattr(BaseRHOSTest, _name, _LazyClient(_name, _manager_attr))
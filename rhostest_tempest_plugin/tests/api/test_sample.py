@@ -17,6 +17,7 @@ from tempest import test
 
 from rhostest_tempest_plugin.services.clients import MySQLClient
 from rhostest_tempest_plugin.services.clients import SSHClient
+from rhostest_tempest_plugin.services import routing
 from rhostest_tempest_plugin.tests.api import base
 
 
@@ -59,8 +60,8 @@ class SampleRHOSTest(base.BaseRHOSTest):
         self.assertEqual('testpassword', server['adminPass'])
 
     def test_ssh_client(self):
-        """Connect to the db hostname and execute `uname -a`"""
-        host = CONF.compute_private_config.target_controller
+        """Connect to a controller and execute `uname -a`"""
+        host = routing.get_router().pick()
         ssh_client = SSHClient()
         command = "uname -a"
         output = ssh_client.execute(host, command)
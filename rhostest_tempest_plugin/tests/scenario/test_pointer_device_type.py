@@ -25,7 +25,6 @@
 from oslo_log import log as logging
 from rhostest_tempest_plugin import base
 from rhostest_tempest_plugin.services import clients
-from tempest.common.utils import data_utils
 from tempest import config
 from tempest import test
 
@@ -35,6 +34,8 @@ LOG = logging.getLogger(__name__)
 
 class PointerDeviceTypeFromImages(base.BaseRHOSTest):
 
+    shared_fixtures = ('image-metadata',)
+
     @classmethod
     def setup_clients(cls):
         super(PointerDeviceTypeFromImages, cls).setup_clients()
@@ -54,34 +55,25 @@ class PointerDeviceTypeFromImages(base.BaseRHOSTest):
         self.assertEqual(req_metadata, resp_metadata)
 
     def _verify_pointer_device_type_from_images(self, server_id):
-        # Retrieve the server's hypervizor hostname
-        server = self.servers_client.show_server(server_id)['server']
-        hostname = server['OS-EXT-SRV-ATTR:host']
-        hypers = self.os_adm.hypervisor_client.list_hypervisors(
-            detail=True)['hypervisors']
-
-        compute_node_address = None
-        for hypervisor in hypers:
-            if hypervisor['service']['host'] == hostname:
-                compute_node_address = hypervisor['host_ip']
+        # Retrieve the address of the server's hypervisor
+        compute_node_address = self._get_server_host_ip(server_id)
         self.assertIsNotNone(compute_node_address)
 
-        # Retrieve input device from virsh dumpxml
+        # Retrieve input devices from virsh dumpxml
         virshxml_client = clients.VirshXMLClient(compute_node_address)
-        output = virshxml_client.dumpxml(server_id)
+        domain = virshxml_client.get_domain(server_id)
         # Verify that input device contains tablet and mouse
-        tablet = "input type='tablet' bus='usb'"
-        mouse = "input type='mouse' bus='ps2'"
-        self.assertTrue(tablet in output)
-        self.assertTrue(mouse in output)
+        input_devices = domain.input_devices()
+        self.assertIn(('tablet', 'usb'), input_devices)
+        self.assertIn(('mouse', 'ps2'), input_devices)
 
     @test.services('compute')
     def test_pointer_device_type_from_images(self):
         image = CONF.compute.image_ref
         self._set_image_metadata_item(image)
-        flavor_name = data_utils.rand_name("test_flavor_")
-        flavor_id = data_utils.rand_int_id(start=1000)
-        self._create_nova_flavor(name=flavor_name, ram=512, vcpus=2, disk=5,
-                                 fid=flavor_id)
-        server = self._create_nova_instance(flavor_id, image)
+        flavor_id = self._get_pooled_flavor(ram=512, vcpus=2, disk=5)
+        # Only the servers booted once the image metadata is set get the
+        # tablet, the server metadata keeps them in a pool of their own.
+        server = self._lease_server(
+            flavor_id, image, metadata={'rhos-pointer-model': 'usbtablet'})
         self._verify_pointer_device_type_from_images(server)
@@ -0,0 +1,95 @@
+# Copyright 2016 Red Hat
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+# Parameters required in etc/tempest.conf
+#    [compute_private_config]
+#    target_controller=
+#    target_ssh_user=
+#    target_private_key_path=
+
+import time
+
+from oslo_log import log as logging
+from rhostest_tempest_plugin import base
+from rhostest_tempest_plugin.lib import quota_audit
+from rhostest_tempest_plugin.services import clients
+from tempest import config
+from tempest import test
+from testtools import content
+
+CONF = config.CONF
+LOG = logging.getLogger(__name__)
+
+
+class QuotaAudit(base.BaseRHOSTest):
+
+    shared_fixtures = ('nova-db',)
+
+    @classmethod
+    def setup_clients(cls):
+        super(QuotaAudit, cls).setup_clients()
+        cls.servers_client = cls.os_adm.servers_client
+        cls.flvclient = cls.os_adm.flavors_client
+
+    @classmethod
+    def resource_setup(cls):
+        super(QuotaAudit, cls).resource_setup()
+        cls.dbclient = clients.MySQLClient()
+
+    @staticmethod
+    def _keys(mismatches):
+        return set((row['project_id'], row['user_id'], row['resource'])
+                   for row in mismatches)
+
+    @test.services('compute')
+    def test_quota_audit_detects_drift(self):
+        flavor_id = self._get_pooled_flavor(ram=512, vcpus=2, disk=5)
+        server_id = self._create_nova_instance(flavor_id)
+        server = self.servers_client.show_server(server_id)['server']
+        project_id = server['tenant_id']
+        user_id = server['user_id']
+
+        self.dbclient.execute_query(
+            'UPDATE quota_usages SET in_use=99 '
+            'WHERE project_id = %s AND user_id = %s',
+            (project_id, user_id))
+        mismatches = quota_audit.find_mismatches(self.dbclient,
+                                                 [project_id])
+        self.assertEqual(set((project_id, user_id, resource)
+                             for resource in ('instances', 'cores', 'ram')),
+                         self._keys(mismatches))
+
+        clients.NovaManageClient().execute_command(
+            'project quota_usage_refresh --project %s --user %s' %
+            (project_id, user_id))
+        self.assertEqual([], quota_audit.find_mismatches(self.dbclient,
+                                                         [project_id]))
+
+    @test.services('compute')
+    def test_quota_audit_all_projects(self):
+        mismatches = quota_audit.find_mismatches(self.dbclient)
+        if mismatches:
+            # Usages of operations in flight, e.g. of concurrent tests,
+            # drift for a moment. Only report the ones which persist.
+            time.sleep(CONF.compute.build_interval)
+            project_ids = sorted(set(row['project_id']
+                                     for row in mismatches))
+            persistent = self._keys(quota_audit.find_mismatches(
+                self.dbclient, project_ids))
+            mismatches = [row for row in mismatches
+                          if (row['project_id'], row['user_id'],
+                              row['resource']) in persistent]
+        self.addDetail('rhos-quota-audit', content.json_content(mismatches))
+        self.assertEqual([], mismatches)
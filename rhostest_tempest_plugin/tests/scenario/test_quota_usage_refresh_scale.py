@@ -0,0 +1,76 @@
+# Copyright 2016 Red Hat
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+# Parameters required in etc/tempest.conf
+#    [compute_private_config]
+#    target_controller=
+#    target_ssh_user=
+#    target_private_key_path=
+#    quota_scale_project_counts=100,1000,5000
+#
+# Against a local db stand-in, also set db_backend=pymysql,
+# db_connection=mysql+pymysql://... and quota_scale_emulate_refresh=True.
+
+from oslo_log import log as logging
+from rhostest_tempest_plugin import base
+from rhostest_tempest_plugin.lib import quota_scale
+from rhostest_tempest_plugin.services import clients
+from tempest import config
+from tempest import test
+from testtools import content
+
+CONF = config.CONF
+LOG = logging.getLogger(__name__)
+
+
+class QuotaUsageRefreshScale(base.BaseRHOSTest):
+
+    shared_fixtures = ('nova-db',)
+
+    @classmethod
+    def skip_checks(cls):
+        super(QuotaUsageRefreshScale, cls).skip_checks()
+        if not CONF.compute_private_config.quota_scale_project_counts:
+            raise cls.skipException('quota_scale_project_counts is not set')
+
+    @classmethod
+    def resource_setup(cls):
+        super(QuotaUsageRefreshScale, cls).resource_setup()
+        cls.dbclient = clients.MySQLClient()
+        if CONF.compute_private_config.quota_scale_emulate_refresh:
+            quota_scale.create_schema(cls.dbclient)
+            cls.refresh = staticmethod(
+                quota_scale.emulated_refresh(cls.dbclient))
+        else:
+            cls.refresh = staticmethod(
+                quota_scale.nova_manage_refresh(clients.NovaManageClient()))
+
+    @test.services('compute')
+    def test_quota_usage_refresh_scale(self):
+        private_config = CONF.compute_private_config
+        reports = []
+        for projects in sorted(int(count) for count in
+                               private_config.quota_scale_project_counts):
+            report = quota_scale.measure(
+                self.dbclient, self.refresh, projects,
+                private_config.quota_scale_instances_per_project,
+                private_config.quota_scale_workers)
+            LOG.info('quota_usage_refresh of %d projects: %s', projects,
+                     report)
+            reports.append(report)
+        self.addDetail('rhos-quota-scale', content.json_content(reports))
+        for report in reports:
+            self.assertEqual(0, report['failures'])
+            self.assertEqual(0, report['stale_usages'])
@@ -22,7 +22,7 @@
 from oslo_log import log as logging
 from rhostest_tempest_plugin import base
 from rhostest_tempest_plugin.services import clients
-from tempest.common.utils import data_utils
+from rhostest_tempest_plugin.services import pipeline as pipeline_client
 from tempest import config
 from tempest import test
 
@@ -32,6 +32,8 @@ LOG = logging.getLogger(__name__)
 
 class RefreshQuotaUsages(base.BaseRHOSTest):
 
+    shared_fixtures = ('nova-db',)
+
     @classmethod
     def setup_clients(cls):
         super(RefreshQuotaUsages, cls).setup_clients()
@@ -44,51 +46,47 @@ class RefreshQuotaUsages(base.BaseRHOSTest):
         cls.dbclient = clients.MySQLClient()
 
     def _compare_resource_count(self, source1, source2):
-        for quota in source1.split("\n"):
-            if quota not in source2:
+        usages = set((row['resource'], row['in_use']) for row in source2)
+        for row in source1:
+            if (row['resource'], row['in_use']) not in usages:
                 return False
         return True
 
     def _verify_refresh_quota_usages(self, server_id):
-        # Retrieve user-id and project-id for instances created
-        dbcommand = """
-        SELECT user_id,project_id
-        FROM instances
-        WHERE uuid = "{}"
-        """.format(server_id)
-        data = self.dbclient.execute_command(dbcommand)
-
-        # Parsing the output of the mysql cli. Not pretty.
-        user_id, project_id = data.split('\n')[1].split("\t")
-
-        # Retrieve the resource count from quota usages table
         dbcommand_select = """
         SELECT resource,in_use
         FROM quota_usages
-        WHERE project_id = "{}"
-        """.format(project_id)
-        data_orig = self.dbclient.execute_command(dbcommand_select)
-        # Update quota usage table to fake values to mimic out of
-        # sync scenario
-        dbcommand_update = """
-        UPDATE quota_usages
-        SET in_use=99
-        WHERE project_id = "{}"
-        """.format(project_id)
-        data = self.dbclient.execute_command(dbcommand_update)
-        data_fake = self.dbclient.execute_command(dbcommand_select)
+        WHERE project_id = (SELECT project_id FROM instances WHERE uuid = %s)
+        """
+        server = self.servers_client.show_server(server_id)['server']
+        # Retrieve the resource count from quota usages table, then update
+        # quota usage table to fake values to mimic out of sync scenario,
+        # trigger a quota refresh using nova-manage and retrieve the
+        # refreshed count. All of it runs on the controller in a single
+        # round trip.
+        pipeline = pipeline_client.RemotePipeline(
+            mysql_client=self.dbclient)
+        pipeline.sql([
+            (dbcommand_select, (server_id,)),
+            ("""
+             UPDATE quota_usages
+             SET in_use=99
+             WHERE project_id = (
+                 SELECT project_id FROM instances WHERE uuid = %s)
+             """, (server_id,)),
+            (dbcommand_select, (server_id,))])
+        pipeline.nova_manage(
+            'project quota_usage_refresh --project %s --user %s' %
+            (server['tenant_id'], server['user_id']))
+        pipeline.sql([(dbcommand_select, (server_id,))])
+        faked, _, synced = pipeline.run()
+        data_orig, _, data_fake = faked.output
+        data_synced = synced.output[0]
         # Verify that update work and quota usage table is different
         # from original state
         compare = self._compare_resource_count(data_orig, data_fake)
         if compare:
             return False
-        # Trigger quota refresh using nova-manage command.
-        cmd = ('project quota_usage_refresh --project %s --user %s' %
-               (project_id, user_id))
-        nova_mg_client = clients.NovaManageClient()
-        nova_mg_client.execute_command(cmd)
-        # Retrieve resource usage count from quota usage table
-        data_synced = self.dbclient.execute_command(dbcommand_select)
         # Verify that resource usage is in sync now
         compare = self._compare_resource_count(data_orig, data_synced)
         if not compare:
@@ -98,13 +96,9 @@ class RefreshQuotaUsages(base.BaseRHOSTest):
 
     @test.services('compute')
     def test_refresh_quota_usages(self):
-        flavor_name = data_utils.rand_name("test_flavor_")
-        flavor_id = data_utils.rand_int_id(start=1000)
         # TODO(jhakimra): these values should be available for configuration
         # from CONF.
-        self._create_nova_flavor(name=flavor_name, ram=512, vcpus=2, disk=5,
-                                 fid=flavor_id)
-        for _ in range(2):
-            server = self._create_nova_instance(flavor_id)
-        result = self._verify_refresh_quota_usages(server)
+        flavor_id = self._get_pooled_flavor(ram=512, vcpus=2, disk=5)
+        servers = self._create_nova_instances(2, flavor_id)
+        result = self._verify_refresh_quota_usages(servers[-1])
         self.assertTrue(result)